@@ -6,4 +6,6 @@ admin.site.register(Item)
 admin.site.register(Comment)
 admin.site.register(Bid)
 admin.site.register(Category)
-admin.site.register(User)
\ No newline at end of file
+admin.site.register(User)
+admin.site.register(ImageJob)
+admin.site.register(StoredBlob)
\ No newline at end of file
@@ -0,0 +1,110 @@
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from .routers import read_primary
+from functools import wraps
+import hashlib
+import time
+
+
+# Seconds a rendered page is kept at most, pages are expired earlier by their namespaces changing
+PAGE_TIMEOUT = 60 * 10
+
+# Namespaces of the cached pages, a page is stored under the current version of each of its
+# namespaces and bumping a version expires every page stored under the previous one
+LISTINGS = 'listings'
+CATEGORIES = 'categories'
+
+
+def category_namespace(category_name):
+    """ Namespace of the pages listing the items of a category """
+    return f'category:{category_name}'
+
+
+def user_namespace(user_id):
+    """ Namespace of the session snapshots of a user, see auctions.middleware """
+    return f'user:{user_id}'
+
+
+def version_key(namespace):
+    return f'version:{namespace}'
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def get_versions(namespaces):
+    """ Current version of each namespace. Versions that aren't in the cache (first use, restart or eviction)
+    start from the current time in milliseconds, so they never go back to a version already used """
+    keys = [version_key(namespace) for namespace in namespaces]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # another process may have initialised it first, add keeps its value
+            cache.add(key, now_ms(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def expire(*namespaces):
+    """ Expires every cached page of the namespaces by bumping their versions """
+    for namespace in namespaces:
+        try:
+            cache.incr(version_key(namespace))
+        except ValueError:
+            cache.set(version_key(namespace), now_ms(), None)
+
+
+def item_namespaces(item):
+    """ Namespaces of the cached listings that may show the item """
+    from .models import Category, Item
+
+    # no query when the category was loaded with the item
+    if Item.category.is_cached(item):
+        name = item.category.category
+    else:
+        name = Category.objects.filter(pk=item.category_id).values_list('category', flat=True).first()
+    return [LISTINGS, category_namespace(name)]
+
+
+def expire_item_pages(item):
+    """ Expires the cached listings that may show the item """
+    expire(*item_namespaces(item))
+
+
+def page_key(view_name, namespaces, request):
+    """ Cache key of a page: the view, the versions of its namespaces and the full path (cursor and size) """
+    versions = '.'.join(str(version) for version in get_versions(namespaces))
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'page:{view_name}:{versions}:{path}'
+
+
+def cache_anonymous(*namespaces):
+    """ Caches the page a view renders for anonymous visitors, until one of its namespaces is expired.
+    Namespaces are formatted with the view arguments, i.e. 'category:{category_name}'.
+    Stored pages are rendered from the primary database, see auctions.routers.read_primary """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+
+            key = page_key(view.__name__, [namespace.format(**kwargs) for namespace in namespaces], request)
+            cached = cache.get(key)
+            if cached is not None:
+                content, content_type = cached
+                response = HttpResponse(content, content_type=content_type)
+            else:
+                # the stored page must show what the expiry was for, not a lagging replica
+                with read_primary():
+                    response = view(request, *args, **kwargs)
+                # pages that set cookies belong to one visitor
+                if response.status_code == 200 and not response.streaming and not response.cookies:
+                    cache.set(key, (response.content, response['Content-Type']), PAGE_TIMEOUT)
+
+            # logged in users get a different page
+            patch_vary_headers(response, ['Cookie'])
+            return response
+        return wrapper
+    return decorator
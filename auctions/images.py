@@ -0,0 +1,80 @@
+from django.core.files.base import ContentFile
+from django.db import transaction
+from PIL import Image, ImageOps
+from .cache import expire_item_pages
+from .models import Item, StoredBlob
+from io import BytesIO
+import os
+
+
+# Widths of the resized copies of item images: cards on the listings and the item page
+RENDITION_WIDTHS = (320, 1024)
+
+# Folder inside the media storage where the resized copies are kept
+RENDITIONS_DIR = 'renditions'
+
+WEBP_QUALITY = 80
+JPEG_QUALITY = 85
+
+
+def rendition_name(image_name, width, extension):
+    """ Name of a resized copy of an image, i.e. renditions/photo_320w.webp """
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    return f'{RENDITIONS_DIR}/{stem}_{width}w.{extension}'
+
+
+def encode(image, image_format, **options):
+    """ Encodes a PIL image into a ContentFile """
+    buffer = BytesIO()
+    image.save(buffer, image_format, **options)
+    return ContentFile(buffer.getvalue())
+
+
+def create_renditions(image_field):
+    """ Resizes the image to every width in RENDITION_WIDTHS (without upscaling it) and stores a
+    WebP copy plus a JPEG one (PNG for transparent images) of each size.
+    Returns the list of renditions to store on Item.renditions """
+    with image_field.storage.open(image_field.name, 'rb') as file:
+        original = Image.open(file)
+        original.load()
+
+    # Phones store the rotation in the EXIF data instead of rotating the pixels
+    original = ImageOps.exif_transpose(original)
+    transparent = original.mode in ('RGBA', 'LA') or 'transparency' in original.info
+    original = original.convert('RGBA' if transparent else 'RGB')
+
+    renditions = []
+    for width in sorted({min(width, original.width) for width in RENDITION_WIDTHS}):
+        resized = original
+        if width < original.width:
+            height = max(1, round(original.height * width / original.width))
+            resized = original.resize((width, height), Image.LANCZOS)
+
+        copies = [('webp', 'WEBP', {'quality': WEBP_QUALITY})]
+        if transparent:
+            copies.append(('png', 'PNG', {}))
+        else:
+            copies.append(('jpeg', 'JPEG', {'quality': JPEG_QUALITY, 'optimize': True, 'progressive': True}))
+
+        for extension, image_format, options in copies:
+            name = image_field.storage.save(
+                rendition_name(image_field.name, width, extension), encode(resized, image_format, **options))
+            renditions.append({'width': width, 'format': extension, 'name': name})
+
+    return renditions
+
+
+def update_renditions(item):
+    """ Creates the renditions of the item image and stores them on the item, as long as
+    the image wasn't replaced in the meantime. Renditions left unused are deleted by gc_blobs """
+    renditions = create_renditions(item.image)
+    with transaction.atomic():
+        updated = Item.objects.filter(pk=item.pk, image=item.image.name).update(renditions=renditions, image_pending=False)
+        if not updated:
+            return []
+        StoredBlob.objects.acquire([rendition['name'] for rendition in renditions])
+
+    item.renditions = renditions
+    item.image_pending = False
+    expire_item_pages(item)
+    return renditions
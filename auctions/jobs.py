@@ -0,0 +1,134 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .cache import expire_item_pages
+from .images import update_renditions
+from .models import ImageJob, Item
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+# Failed jobs are retried after RETRY_DELAY, 2 * RETRY_DELAY, 4 * RETRY_DELAY...
+MAX_ATTEMPTS = 5
+RETRY_DELAY = timedelta(seconds=30)
+
+# Time a worker has to finish a job before it's considered crashed and the job is run again
+LEASE = timedelta(minutes=5)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def enqueue_renditions(item):
+    """ Stores a job to resize the item image, and wakes the in-process workers once it commits """
+    ImageJob.objects.create(item=item, image=item.image.name)
+    transaction.on_commit(wake_workers)
+
+
+def wake_workers():
+    """ Lets the in-process worker pool run the pending jobs, unless they're left to the
+    process_image_jobs command (IMAGE_JOB_WORKERS = 0). The pool only wakes up for new jobs,
+    the worker process of the Procfile runs the retries and the jobs of crashed workers """
+    global _executor
+    workers = getattr(settings, 'IMAGE_JOB_WORKERS', 2)
+    if not workers:
+        return
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-jobs')
+    _executor.submit(run_in_worker)
+
+
+def run_in_worker():
+    try:
+        process_pending_jobs()
+    except Exception:
+        logger.exception("Image job worker stopped")
+    finally:
+        # Worker threads open their own connection
+        connection.close()
+
+
+def runnable_jobs(now):
+    """ Pending jobs that are due, and running jobs whose worker crashed with attempts left """
+    return ImageJob.objects.filter(
+        Q(status=ImageJob.PENDING, run_after__lte=now)
+        | Q(status=ImageJob.RUNNING, locked_until__lt=now, attempts__lt=MAX_ATTEMPTS)
+    )
+
+
+def give_up(job):
+    """ Lets the item of a failed job show its original image from now on """
+    if Item.objects.filter(pk=job.item_id, image=job.image).update(image_pending=False):
+        expire_item_pages(job.item)
+
+
+def fail_abandoned_jobs():
+    """ Marks as failed the running jobs whose worker crashed on their last attempt, so a job
+    that kills its worker isn't retried forever. Returns how many there were """
+    abandoned = ImageJob.objects.filter(
+        status=ImageJob.RUNNING, locked_until__lt=timezone.now(), attempts__gte=MAX_ATTEMPTS)
+    failed = 0
+    for job in abandoned.select_related('item'):
+        if abandoned.filter(pk=job.pk).update(
+                status=ImageJob.FAILED, locked_until=None, last_error="The worker stopped before finishing"):
+            give_up(job)
+            failed += 1
+    return failed
+
+
+def claim_job():
+    """ Marks the next runnable job as running and returns it, or returns None if there are none.
+    The claim is a conditional UPDATE, so two workers never get the same job """
+    while True:
+        now = timezone.now()
+        job_id = runnable_jobs(now).order_by('run_after', 'id').values_list('id', flat=True).first()
+        if job_id is None:
+            return None
+
+        claimed = runnable_jobs(now).filter(pk=job_id).update(
+            status=ImageJob.RUNNING, locked_until=now + LEASE, attempts=F('attempts') + 1)
+        if claimed:
+            return ImageJob.objects.select_related('item').get(pk=job_id)
+
+
+def run_job(job):
+    """ Creates the renditions of the job image, scheduling a retry if it fails """
+    item = job.item
+    try:
+        # The image was replaced or removed since the job was created
+        if item.image.name == job.image:
+            update_renditions(item)
+    except Exception as error:
+        logger.exception("Image job %s failed", job.pk)
+        job.last_error = repr(error)
+        if job.attempts >= MAX_ATTEMPTS:
+            job.status = ImageJob.FAILED
+            give_up(job)
+        else:
+            job.status = ImageJob.PENDING
+            job.run_after = timezone.now() + RETRY_DELAY * 2 ** (job.attempts - 1)
+    else:
+        job.status = ImageJob.DONE
+
+    job.locked_until = None
+    job.save(update_fields=['status', 'run_after', 'locked_until', 'last_error'])
+
+
+def process_pending_jobs(limit=None):
+    """ Runs runnable jobs until there are none left or limit jobs were run, returns how many ran """
+    fail_abandoned_jobs()
+    done = 0
+    while limit is None or done < limit:
+        job = claim_job()
+        if job is None:
+            break
+        run_job(job)
+        done += 1
+    return done
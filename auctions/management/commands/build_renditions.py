@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from auctions.images import update_renditions
+from auctions.models import Item, StoredBlob
+
+
+class Command(BaseCommand):
+    help = "Creates the resized copies of item images that don't have them yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument('item_ids', nargs='*', type=int, help="Only build the renditions of these items")
+        parser.add_argument('--force', action='store_true', help="Rebuild renditions that already exist")
+
+    def handle(self, *args, **options):
+        items = Item.objects.filter(has_image=True)
+        if options['item_ids']:
+            items = items.filter(pk__in=options['item_ids'])
+        if not options['force']:
+            items = items.filter(renditions=[])
+
+        built = 0
+        for item in items.iterator():
+            try:
+                old_renditions = item.renditions
+                renditions = update_renditions(item)
+            except (OSError, ValueError) as error:
+                self.stderr.write(f"Item {item.pk}: {error}")
+                continue
+            # the image was replaced meanwhile, which already released its renditions
+            if not renditions:
+                continue
+            StoredBlob.objects.release([rendition['name'] for rendition in old_renditions])
+            built += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Built the renditions of {built} items"))
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from importlib import import_module
+
+
+class Command(BaseCommand):
+    help = "Deletes expired sessions, or every session with --all, in batches along with their cached copies"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Sessions deleted per query")
+        parser.add_argument('--all', action='store_true', help="Expire every session, logging everybody out")
+
+    def handle(self, *args, **options):
+        sessions = Session.objects.all()
+        if not options['all']:
+            sessions = sessions.filter(expire_date__lt=timezone.now())
+
+        # cached sessions are stored under a prefix of the session key
+        prefix = getattr(import_module(settings.SESSION_ENGINE).SessionStore, 'cache_key_prefix', None)
+        cache = caches[settings.SESSION_CACHE_ALIAS]
+
+        deleted = 0
+        last_key = ''
+        while True:
+            keys = list(sessions.filter(session_key__gt=last_key).order_by('session_key')
+                .values_list('session_key', flat=True)[:options['batch_size']])
+            if not keys:
+                break
+            last_key = keys[-1]
+
+            # sessions used since the batch was read have a new expire date and are kept
+            deleted += sessions.filter(session_key__in=keys).delete()[0]
+            if prefix is not None:
+                cache.delete_many([prefix + key for key in keys])
+
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} sessions"))
@@ -0,0 +1,39 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from auctions.models import StoredBlob
+from datetime import timedelta
+
+
+class Command(BaseCommand):
+    help = "Deletes the stored files no item image or rendition references anymore, in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Files looked at per query")
+        parser.add_argument('--grace', type=int, default=3600,
+            help="Seconds a file stays unreferenced before it's deleted, so uploads in progress are spared")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=options['grace'])
+        collectable = StoredBlob.objects.filter(refs=0, updated_at__lt=cutoff)
+
+        deleted = 0
+        last_id = 0
+        while True:
+            batch = list(collectable.filter(id__gt=last_id).order_by('id').values_list('id', 'name')[:options['batch_size']])
+            if not batch:
+                break
+            last_id = batch[-1][0]
+
+            for blob_id, name in batch:
+                # the file may have been referenced or stored again since the batch was read.
+                # Uploads of the same content wait for the row to be deleted along with the file,
+                # then create a new row and write the file again
+                with transaction.atomic():
+                    if not collectable.filter(id=blob_id).delete()[0]:
+                        continue
+                    default_storage.delete(name)
+                deleted += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} unreferenced files"))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from auctions.jobs import process_pending_jobs
+import time
+
+
+class Command(BaseCommand):
+    help = "Runs the pending image jobs, and keeps polling for new ones unless --once is given"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Exit when there are no runnable jobs left")
+        parser.add_argument('--interval', type=float, default=5, help="Seconds between polls")
+
+    def handle(self, *args, **options):
+        while True:
+            done = process_pending_jobs()
+            if done:
+                self.stdout.write(f"Ran {done} image jobs")
+            if options['once']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from auctions.models import Item
+
+
+class Command(BaseCommand):
+    help = "Recomputes the current_price, bid_count and top_bid columns of items from their bids"
+
+    def add_arguments(self, parser):
+        parser.add_argument('item_ids', nargs='*', type=int, help="Only rebuild these items")
+
+    def handle(self, *args, **options):
+        items = Item.objects.all()
+        if options['item_ids']:
+            items = items.filter(pk__in=options['item_ids'])
+
+        updated = items.rebuild_bid_totals()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the bid totals of {updated} items"))
@@ -0,0 +1,90 @@
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth import SESSION_KEY
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.utils.functional import SimpleLazyObject
+from .cache import get_versions, user_namespace
+from .models import User
+from .routers import PIN_COOKIE, RequestState, request_state
+import time
+
+
+# Session key of the snapshot of the logged in user
+SNAPSHOT_KEY = '_auth_user_snapshot'
+
+# Columns kept in the snapshot, any other column is loaded from the database the first time it's used
+SNAPSHOT_FIELDS = ('id', 'username', 'is_active', 'is_staff', 'is_superuser')
+
+# Seconds a snapshot is trusted at most, it bounds how long a change made through another
+# process' cache can go unnoticed
+SNAPSHOT_TIMEOUT = 60 * 5
+
+
+def user_version(user_id):
+    """ Current version of a user, bumped every time the user is saved """
+    return get_versions([user_namespace(user_id)])[0]
+
+
+def remember_user(session, user):
+    """ Stores a snapshot of the user in the session, tagged with the current version of the user """
+    session[SNAPSHOT_KEY] = {
+        'values': {field: getattr(user, field) for field in SNAPSHOT_FIELDS},
+        'version': user_version(user.pk),
+        'taken_at': time.time(),
+    }
+
+
+def snapshot_is_current(snapshot, user_id):
+    """ The snapshot belongs to the logged in user, who wasn't saved since it was taken """
+    return (
+        snapshot is not None
+        and user_id is not None
+        and str(snapshot['values']['id']) == str(user_id)
+        and time.time() - snapshot['taken_at'] < SNAPSHOT_TIMEOUT
+        and snapshot['version'] == user_version(user_id)
+    )
+
+
+def get_user(request):
+    """ The logged in user, built from the session snapshot without a query while it's current.
+    Otherwise the user is loaded and verified by django's auth and a new snapshot is taken """
+    snapshot = request.session.get(SNAPSHOT_KEY)
+    if snapshot_is_current(snapshot, request.session.get(SESSION_KEY)):
+        # from_db takes the values in the order of the model fields
+        fields = [field.attname for field in User._meta.concrete_fields if field.attname in SNAPSHOT_FIELDS]
+        return User.from_db(User.objects.db, fields, [snapshot['values'][field] for field in fields])
+
+    user = auth.get_user(request)
+    if user.is_authenticated:
+        remember_user(request.session, user)
+    return user
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    """ AuthenticationMiddleware that doesn't query the users table on every request.
+    The user is built from a snapshot of its id, username and flags kept in the session,
+    which is taken again whenever the user is saved (i.e. a password change or deactivation) """
+
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: get_user(request))
+
+
+class PrimaryPinMiddleware:
+    """ Keeps the reads of a client on the primary database for REPLICA_PIN_SECONDS after it writes,
+    so bidders see their own bids even while the replica lags behind """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state = RequestState(pinned=PIN_COOKIE in request.COOKIES)
+        token = request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_state.reset(token)
+
+        if state.wrote and getattr(settings, 'REPLICA_DATABASE', None):
+            response.set_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.7 on 2026-10-18 03:39
+
+from django.db import migrations, models
+
+
+def record_existing_images(apps, schema_editor):
+    """ Checks once which of the existing items have their image file on disk """
+    Item = apps.get_model('auctions', 'Item')
+    items = Item.objects.using(schema_editor.connection.alias)
+    for item in items.exclude(image=''):
+        try:
+            exists = item.image.storage.exists(item.image.name)
+        except Exception:
+            exists = False
+        if exists:
+            items.filter(pk=item.pk).update(has_image=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0005_alter_item_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='has_image',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(record_existing_images, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.2.7 on 2026-10-18 03:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_bid_totals(apps, schema_editor):
+    """ Copies the price columns from the existing bids """
+    Item = apps.get_model('auctions', 'Item')
+    Bid = apps.get_model('auctions', 'Bid')
+    db_alias = schema_editor.connection.alias
+    top = Bid.objects.using(db_alias).filter(item=OuterRef('pk')).order_by('-bid', 'id')
+    count = Bid.objects.using(db_alias).filter(item=OuterRef('pk')).values('item').annotate(count=Count('id')).values('count')
+    Item.objects.using(db_alias).update(
+        current_price=Subquery(top.values('bid')[:1]),
+        top_bid=Subquery(top.values('id')[:1]),
+        bid_count=Coalesce(Subquery(count), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0006_item_has_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='bid_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='current_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='top_bid',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='auctions.bid'),
+        ),
+        migrations.RunPython(fill_bid_totals, migrations.RunPython.noop),
+    ]
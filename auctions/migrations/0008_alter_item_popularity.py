@@ -0,0 +1,19 @@
+# Generated by Django 3.2.7 on 2026-10-18 03:52
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0007_item_bid_totals'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='item',
+            name='popularity',
+            field=models.PositiveSmallIntegerField(default=0, validators=[django.core.validators.MaxValueValidator(32767)]),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.7 on 2026-10-18 03:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0008_alter_item_popularity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='renditions',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 3.2.7 on 2026-10-18 04:19
+
+from django.db import migrations, models
+from collections import Counter
+import django.utils.timezone
+
+
+def count_existing_references(apps, schema_editor):
+    """ Registers the files already used by items, which keep their original names """
+    Item = apps.get_model('auctions', 'Item')
+    StoredBlob = apps.get_model('auctions', 'StoredBlob')
+    db_alias = schema_editor.connection.alias
+    refs = Counter()
+    for image, renditions in Item.objects.using(db_alias).exclude(image='').values_list('image', 'renditions').iterator():
+        refs[image] += 1
+        refs.update(rendition['name'] for rendition in renditions)
+    StoredBlob.objects.using(db_alias).bulk_create(
+        [StoredBlob(name=name, refs=count) for name, count in refs.items()], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0010_imagejob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('refs', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RunPython(count_existing_references, migrations.RunPython.noop),
+    ]
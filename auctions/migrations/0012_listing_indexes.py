@@ -0,0 +1,33 @@
+# Generated by Django 3.2.7 on 2026-10-18 05:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0011_storedblob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bid',
+            index=models.Index(fields=['item', '-bid', '-id'], name='bid_item_bid_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('active', True)), fields=['-updated_at', '-id'], name='item_active_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('active', True)), fields=['-popularity', '-id'], name='item_active_popular_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('active', True)), fields=['category', '-updated_at', '-id'], name='item_category_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('active', True)), fields=['user', '-created_at', '-id'], name='item_user_created_idx'),
+        ),
+    ]
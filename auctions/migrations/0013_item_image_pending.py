@@ -0,0 +1,28 @@
+# Generated by Django 3.2.7 on 2026-10-18 05:28
+
+from django.db import migrations, models
+
+
+def mark_pending_images(apps, schema_editor):
+    """ Items whose current image still has a job to run wait for its renditions, the others show their original """
+    Item = apps.get_model('auctions', 'Item')
+    db_alias = schema_editor.connection.alias
+    Item.objects.using(db_alias).filter(
+        renditions=[], image_jobs__status__in=['pending', 'running'], image_jobs__image=models.F('image'),
+    ).update(image_pending=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0012_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='image_pending',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(mark_pending_images, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,11 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.core.validators import MaxValueValidator
+from django.db import models, transaction, IntegrityError
+from django.db.models.functions import Coalesce
 from django.utils import timezone
-from datetime import datetime
-import os
+from decimal import Decimal
+from .cache import expire_item_pages
+from .timesince import elapsed_since, format_elapsed
 
 
 class User(AbstractUser):
@@ -21,8 +24,41 @@ class Category(models.Model):
 		return self.category
 
 
+# Largest value a PositiveSmallIntegerField can hold on every database
+POPULARITY_MAX = 32767
+
+
+class ItemQuerySet(models.QuerySet):
+	"""Custom queries for items"""
+
+	# Columns read by the item cards in items.html and by the listing pagination
+	LISTING_FIELDS = (
+		'id', 'name', 'starting_price', 'current_price', 'bid_count', 'created_at',
+		'updated_at', 'popularity', 'image', 'has_image', 'renditions', 'image_pending', 'user__username',
+		'category__category',
+	)
+
+	def listing(self):
+		""" Items ready to be rendered as cards, joined with their user and category in a single query """
+		return self.select_related('user', 'category').only(*self.LISTING_FIELDS)
+
+	def rebuild_bid_totals(self):
+		""" Recomputes current_price, bid_count and top_bid from the Bid table in a single UPDATE.
+		Equal bids are won by the earliest one, as later ones wouldn't have been accepted """
+		top = Bid.objects.filter(item=models.OuterRef('pk')).order_by('-bid', 'id')
+		count = Bid.objects.filter(item=models.OuterRef('pk')).values('item').annotate(
+			count=models.Count('id')).values('count')
+		return self.update(
+			current_price=models.Subquery(top.values('bid')[:1]),
+			top_bid=models.Subquery(top.values('id')[:1]),
+			bid_count=Coalesce(models.Subquery(count), 0),
+		)
+
+
 class Item(models.Model):
 	"""Models an item in the auction"""
+	objects = ItemQuerySet.as_manager()
+
 	name = models.CharField(max_length=100)
 	
 	# TextField simulates a textarea field, can be empty
@@ -46,6 +82,17 @@ class Item(models.Model):
 	# users can optionally add an image for their item, and they're sent to 'static/auctions/images' folder
 	image = models.ImageField(blank=True)
 
+	# whether the item has an image file, recorded when the image is uploaded so
+	# rendering the item doesn't have to check the file system
+	has_image = models.BooleanField(default=False)
+
+	# resized copies of the image made by auctions.images, as {'width', 'format', 'name'} dicts
+	renditions = models.JSONField(default=list, blank=True)
+
+	# whether a job of auctions.jobs is still going to resize the image. Cleared when the renditions
+	# are stored or the job gives up, items without renditions then show their original image
+	image_pending = models.BooleanField(default=False)
+
 	# Field that stores the name of users that have any item as their watchlist
 	watchlist = models.ManyToManyField(User, related_name="watchlist", blank=True)
 
@@ -54,82 +101,159 @@ class Item(models.Model):
 
 	# increases everytime a comment or bid is made on the item, and when
 	# it's added on someone's watchlist. Decreases when taken off of a watchlist
-	popularity = models.PositiveSmallIntegerField(default=0)
+	popularity = models.PositiveSmallIntegerField(default=0, validators=[MaxValueValidator(POPULARITY_MAX)])
+
+	# Copied from the bids of the item whenever a bid is made, so pages can show
+	# the price without aggregating the bids. current_price is empty while there are no bids
+	current_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+	bid_count = models.PositiveIntegerField(default=0)
+	top_bid = models.ForeignKey('Bid', null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+
+	class Meta:
+		# One per listing: active items by recency or popularity, by category and by seller, in the
+		# order of their pagination keys. Closed items are never listed so only active ones are indexed,
+		# on databases without partial indexes Django leaves these out
+		indexes = [
+			models.Index(fields=['-updated_at', '-id'], condition=models.Q(active=True), name='item_active_updated_idx'),
+			models.Index(fields=['-popularity', '-id'], condition=models.Q(active=True), name='item_active_popular_idx'),
+			models.Index(fields=['category', '-updated_at', '-id'], condition=models.Q(active=True), name='item_category_updated_idx'),
+			models.Index(fields=['user', '-created_at', '-id'], condition=models.Q(active=True), name='item_user_created_idx'),
+		]
 	
 	def __str__(self):
 		return f"Item {self.id}: {self.name} for ${self.starting_price}. Posted by {self.user.username}"
 
+	@property
+	def price(self):
+		""" Highest bid of the item, or its starting price if there are no bids """
+		if self.current_price is None:
+			return self.starting_price
+		return self.current_price
+
+	def place_bid(self, user, amount):
+		""" Bids amount on the item if it's higher than its price, returns the new bid or None.
+		The price is claimed with a conditional UPDATE before the bid is inserted: the row stays
+		locked until the transaction ends, so concurrent bids are checked one after the other
+		against the committed price. Equal bids are won by the first one to claim the price """
+		amount = Decimal(str(amount))
+		higher = models.Q(current_price__lt=amount) | models.Q(current_price__isnull=True, starting_price__lt=amount)
+
+		with transaction.atomic():
+			claimed = Item.objects.filter(higher, pk=self.pk, active=True).update(current_price=amount)
+			if not claimed:
+				return None
+
+			# The bid signals update bid_count, top_bid and current_price inside this same transaction
+			return Bid.objects.create(bid=amount, item=self, user=user)
+
+	def is_watched_by(self, user):
+		""" Whether the item is on the user's watchlist. A single EXISTS on the unique (item, user)
+		index of the watchlist table, the watchers themselves are never loaded """
+		if not user.is_authenticated:
+			return False
+		return Item.watchlist.through.objects.filter(item_id=self.pk, user_id=user.pk).exists()
+
+	@staticmethod
+	def watched_ids(user, items):
+		""" Ids of the given items that are on the user's watchlist, in one query for a whole listing page """
+		if not user.is_authenticated or not items:
+			return set()
+		return set(Item.watchlist.through.objects.filter(
+			user_id=user.pk, item_id__in=[item.pk for item in items]).values_list('item_id', flat=True))
+
+	def add_watcher(self, user):
+		""" Puts the item on the user's watchlist, returns whether it wasn't there yet.
+		A single INSERT guarded by the unique (item, user) index, popularity only goes up when a row
+		is actually inserted so adding twice is harmless """
+		try:
+			with transaction.atomic():
+				Item.watchlist.through.objects.create(item_id=self.pk, user_id=user.pk)
+				self.increase_popularity()
+		except IntegrityError:
+			return False
+		expire_item_pages(self)
+		return True
+
+	def remove_watcher(self, user):
+		""" Takes the item off the user's watchlist, returns whether it was there.
+		A single DELETE, popularity only goes down when a row is actually deleted """
+		with transaction.atomic():
+			deleted, _ = Item.watchlist.through.objects.filter(item_id=self.pk, user_id=user.pk).delete()
+			if not deleted:
+				return False
+			self.decrease_popularity()
+		expire_item_pages(self)
+		return True
+
+	def toggle_watcher(self, user):
+		""" Removes the item from the user's watchlist, or adds it if it wasn't there. Returns whether it's watched now """
+		if self.remove_watcher(user):
+			return False
+		# a concurrent toggle may have added it in between, in which case it stays
+		self.add_watcher(user)
+		return True
+
 	@property
 	def image_url(self):
 		""" Handles no input image """
-		# Image exists
-		try:
-			img = self.image.url
-			imgpath = self.image.path
+		if not self.has_image:
+			return ''
+		return self.image.url
+
+	def rendition_srcset(self, webp=False):
+		""" srcset attribute value listing the WebP renditions, or the JPEG/PNG ones """
+		return ', '.join(
+			f"{self.image.storage.url(rendition['name'])} {rendition['width']}w"
+			for rendition in self.renditions
+			if (rendition['format'] == 'webp') == webp
+		)
+
+	@property
+	def image_srcset(self):
+		return self.rendition_srcset()
+
+	@property
+	def image_webp_srcset(self):
+		return self.rendition_srcset(webp=True)
 
-		# Image doesn't exist
-		except:
-			img = ''
-			imgpath = ''
-		
-		if not os.path.exists(imgpath):
-			img = ''
+	@property
+	def card_image_url(self):
+		""" Smallest JPEG/PNG rendition of the image, or the original image if it has no renditions.
+		Empty while they are being made """
+		for rendition in self.renditions:
+			if rendition['format'] != 'webp':
+				return self.image.storage.url(rendition['name'])
+		if self.image_processing:
+			return ''
+		return self.image_url
 
-		return img
+	@property
+	def image_processing(self):
+		""" The item has an image whose renditions are still being made """
+		return self.has_image and self.image_pending and not self.renditions
 
 	def increase_popularity(self):
-		""" Increases popularity count by one """
-		self.popularity += 1
-		self.save()
+		""" Increases popularity count by one, up to POPULARITY_MAX.
+		Runs a single UPDATE so concurrent changes aren't lost and no save signals are sent """
+		if Item.objects.filter(pk=self.pk, popularity__lt=POPULARITY_MAX).update(popularity=models.F('popularity') + 1):
+			self.popularity = min(self.popularity + 1, POPULARITY_MAX)
 
 	def decrease_popularity(self):
-		""" Decreases popularity count by one """
-		self.popularity -= 1
-		self.save()
+		""" Decreases popularity count by one, down to 0 """
+		if Item.objects.filter(pk=self.pk, popularity__gt=0).update(popularity=models.F('popularity') - 1):
+			self.popularity = max(self.popularity - 1, 0)
 
 
 	def elapsed_time(self, time_value=0):
 		""" Calculates the difference between created_at and now() """
-		time = ''
-
-		# Comment or bid datetime or testing time
+		# Comment or bid timestamp
+		if type(time_value) is float:
+			return elapsed_since([time_value])[0]
+		# testing time
 		if time_value:
-			# Comment or bid timestamp
-			if type(time_value) is float:
-				time_created = round(datetime.now().timestamp() - time_value)
-			# testing time
-			else:
-				time_created = time_value
-
+			return format_elapsed(time_value)
 		# item instance
-		else:
-			time_created = round(datetime.now().timestamp() - self.created_at.timestamp())
-		
-		if 0 <= time_created < 3600:
-			time_created = time_created // 60
-			time += str(time_created) + ' minute'
-
-		elif 3600 < time_created < 86400:
-			time_created = time_created // 3600
-			time += str(time_created) + ' hour'
-
-		elif 86400 < time_created < 2628000:
-			time_created = time_created // 86400
-			time += str(time_created) + ' day' 
-
-		elif 2628000 < time_created < 31536000:
-			time_created = time_created // 2628000
-			time += str(time_created) + ' month'
-
-		elif time_created > 31536000: 
-			time_created = time_created // 31536000
-			time += str(time_created) + ' year'
-
-		if time_created != 1:
-			time += 's'     # pluralize
-
-		time += ' ago'
-		return time
+		return elapsed_since([self.created_at])[0]
 
 
 class Bid(models.Model):
@@ -144,12 +268,16 @@ class Bid(models.Model):
 	
 	#person doing the bid
 	user = models.ForeignKey(User, on_delete=models.CASCADE)
+
+	class Meta:
+		# bid history of an item, highest first
+		indexes = [models.Index(fields=['item', '-bid', '-id'], name='bid_item_bid_idx')]
 	
 	def __str__(self):
 		return f"Bid {self.bid} on {self.item.name} by {self.user.username}"
 
 	def bid_time(self):
-		return self.item.elapsed_time(self.bid_date.timestamp())
+		return elapsed_since([self.bid_date])[0]
 
 
 class Comment(models.Model):
@@ -170,5 +298,95 @@ class Comment(models.Model):
 		return f"Comment by {self.user.username} on {self.item.name} at {self.date}"
 
 	def comment_time(self):
-		return self.item.elapsed_time(self.date.timestamp())
+		return elapsed_since([self.date])[0]
+
+
+class ImageJob(models.Model):
+	""" Resizing work for an item image, done outside of the request by auctions.jobs """
+	PENDING = 'pending'
+	RUNNING = 'running'
+	DONE = 'done'
+	FAILED = 'failed'
+	STATUSES = [
+		(PENDING, 'Pending'),
+		(RUNNING, 'Running'),
+		(DONE, 'Done'),
+		(FAILED, 'Failed'),
+	]
+
+	item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name="image_jobs")
+
+	# name of the image the job was created for, the job is skipped if the image changes
+	image = models.CharField(max_length=100)
+
+	status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+
+	# times the job was started, failed jobs are retried until MAX_ATTEMPTS
+	attempts = models.PositiveSmallIntegerField(default=0)
 
+	# pending jobs wait until this date, used to space out retries
+	run_after = models.DateTimeField(default=timezone.now)
+
+	# running jobs whose worker didn't finish by this date are assumed crashed and run again
+	locked_until = models.DateTimeField(null=True, blank=True)
+
+	last_error = models.TextField(blank=True)
+
+	created_at = models.DateTimeField(auto_now_add=True)
+
+	def __str__(self):
+		return f"Image job {self.id} for item {self.item_id}: {self.status}"
+
+
+class StoredBlobQuerySet(models.QuerySet):
+	"""Reference counting of the files in the content-addressed storage"""
+
+	def register(self, name):
+		""" Records a file that is being stored (or stored again), which the garbage collection
+		spares for a while so it can be referenced. Returns whether the row had to be created,
+		in which case the file may have been collected and must be written """
+		now = timezone.now()
+		if self.filter(name=name).update(updated_at=now):
+			return False
+		try:
+			with transaction.atomic():
+				self.create(name=name, updated_at=now)
+		# registered at the same time by another upload of the same content
+		except IntegrityError:
+			self.filter(name=name).update(updated_at=now)
+			return False
+		return True
+
+	def acquire(self, names):
+		""" Adds a reference to each file, items using them keep them from being collected """
+		now = timezone.now()
+		for name in names:
+			if self.filter(name=name).update(refs=models.F('refs') + 1, updated_at=now):
+				continue
+			try:
+				with transaction.atomic():
+					self.create(name=name, refs=1, updated_at=now)
+			except IntegrityError:
+				self.filter(name=name).update(refs=models.F('refs') + 1, updated_at=now)
+
+	def release(self, names):
+		""" Removes a reference to each file, files left without references are deleted by gc_blobs """
+		if names:
+			self.filter(name__in=names, refs__gt=0).update(refs=models.F('refs') - 1, updated_at=timezone.now())
+
+
+class StoredBlob(models.Model):
+	""" A file of the content-addressed storage and the number of references to it from item images and renditions """
+	objects = StoredBlobQuerySet.as_manager()
+
+	# storage name of the file, derived from its sha256
+	name = models.CharField(max_length=255, unique=True)
+
+	refs = models.PositiveIntegerField(default=0)
+
+	# last time the file was stored or its references changed, unreferenced files are
+	# only collected some time after it so a file being uploaded isn't deleted before it's saved
+	updated_at = models.DateTimeField(default=timezone.now)
+
+	def __str__(self):
+		return f"{self.name}: {self.refs} references"
@@ -0,0 +1,146 @@
+import base64
+import binascii
+import json
+from decimal import Decimal
+
+from django.db.models import Q
+
+
+# Amount of items per page, clients may ask for less or more up to the max
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 50
+
+# Bids and comments rendered with the item page, older ones are loaded a page at a time
+HISTORY_SIZE = 10
+
+# Cursor directions
+NEXT = 'n'
+PREVIOUS = 'p'
+
+# Range of the widest integer columns, larger numbers can't even be sent to the database
+INTEGER_RANGE = range(-2 ** 63, 2 ** 63)
+
+
+class KeysetPage:
+    """ A page of objects along with the opaque cursors of its neighbour pages """
+
+    def __init__(self, object_list, page_size, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.page_size = page_size
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def encode_cursor(direction, values):
+    """ Turns a direction and the ordering values of an object into an url safe token """
+    values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+    # decimals keep their exact value as strings, to_python reads them back
+    values = [str(value) if isinstance(value, Decimal) else value for value in values]
+    data = json.dumps([direction, values], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_cursor(cursor, model, keys):
+    """ Returns the (direction, values) pair stored in a cursor, or None if it's not valid """
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, values = json.loads(data)
+    except (binascii.Error, ValueError, TypeError):
+        return None
+
+    if direction not in (NEXT, PREVIOUS) or not isinstance(values, list) or len(values) != len(keys):
+        return None
+
+    # clean also runs the validators of the fields, like their max values
+    try:
+        values = [model._meta.get_field(key).clean(value, None) for key, value in zip(keys, values)]
+    except Exception:
+        return None
+
+    # to_python leaves unparseable date strings as None
+    if None in values:
+        return None
+
+    if any(isinstance(value, int) and value not in INTEGER_RANGE for value in values):
+        return None
+
+    return direction, values
+
+
+def keyset_filter(keys, values, lookup):
+    """ Builds (k1 < v1) OR (k1 = v1 AND k2 < v2) OR ... for the given comparison lookup """
+    condition = Q()
+    for i, key in enumerate(keys):
+        equal = {k: v for k, v in zip(keys[:i], values[:i])}
+        condition |= Q(**equal, **{f'{key}__{lookup}': values[i]})
+    return condition
+
+
+def key_values(obj, keys):
+    """ Values of the ordering keys of an object """
+    return [getattr(obj, key) for key in keys]
+
+
+def get_page_size(request):
+    """ Page size asked on the url, capped to MAX_PAGE_SIZE """
+    try:
+        size = int(request.GET.get('size', PAGE_SIZE))
+    except ValueError:
+        return PAGE_SIZE
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def paginate(queryset, keys, cursor=None, page_size=PAGE_SIZE):
+    """ Returns a KeysetPage of the queryset ordered by keys in descending order.
+    The last key must be unique (i.e. 'id') so every object has a fixed position, which
+    keeps pages stable while objects are added or reordered and makes page N as cheap as page 1 """
+    keys = tuple(keys)
+    decoded = decode_cursor(cursor, queryset.model, keys) if cursor else None
+    descending = [f'-{key}' for key in keys]
+
+    # First page
+    if decoded is None:
+        objects = list(queryset.order_by(*descending)[:page_size + 1])
+        has_more = len(objects) > page_size
+        objects = objects[:page_size]
+        previous_cursor = None
+        next_cursor = encode_cursor(NEXT, key_values(objects[-1], keys)) if has_more else None
+
+    # Objects coming after the cursor
+    elif decoded[0] == NEXT:
+        condition = keyset_filter(keys, decoded[1], 'lt')
+        objects = list(queryset.filter(condition).order_by(*descending)[:page_size + 1])
+        has_more = len(objects) > page_size
+        objects = objects[:page_size]
+        next_cursor = encode_cursor(NEXT, key_values(objects[-1], keys)) if has_more else None
+        previous_cursor = encode_cursor(PREVIOUS, key_values(objects[0], keys)) if objects else None
+
+    # Objects coming before the cursor, fetched backwards and put back in order
+    else:
+        condition = keyset_filter(keys, decoded[1], 'gt')
+        objects = list(queryset.filter(condition).order_by(*keys)[:page_size + 1])
+        has_more = len(objects) > page_size
+        objects = objects[:page_size][::-1]
+        previous_cursor = encode_cursor(PREVIOUS, key_values(objects[0], keys)) if has_more else None
+        next_cursor = encode_cursor(NEXT, key_values(objects[-1], keys)) if objects else None
+
+    return KeysetPage(objects, page_size, next_cursor, previous_cursor)
+
+
+def paginate_request(request, queryset, keys):
+    """ Paginates the queryset with the cursor and size given in the request url """
+    return paginate(queryset, keys, request.GET.get('cursor'), get_page_size(request))
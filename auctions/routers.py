@@ -0,0 +1,83 @@
+from django.conf import settings
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+
+# Models the listing and detail pages read, the only ones that may be read from the replica.
+# Users, sessions and the image bookkeeping are always read from the primary
+REPLICA_MODELS = {'auctions.item', 'auctions.bid', 'auctions.comment', 'auctions.category', 'auctions.item_watchlist'}
+
+# Cookie set on the clients that just wrote, their reads stay on the primary until it expires
+PIN_COOKIE = 'primary'
+
+# Whether the running view allows replica reads, set by use_replica
+replica_reads = ContextVar('replica_reads', default=False)
+
+# Routing state of the running request, set by auctions.middleware.PrimaryPinMiddleware
+request_state = ContextVar('request_state', default=None)
+
+# Set while rendering a page that is going to be cached for other requests, see read_primary
+primary_reads = ContextVar('primary_reads', default=False)
+
+
+class RequestState:
+    """ Whether the client is pinned to the primary, and whether the request wrote anything """
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+def use_replica(view):
+    """ Lets the GET and HEAD requests of a view read the listing and detail models from the replica """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+        token = replica_reads.set(True)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            replica_reads.reset(token)
+    return wrapper
+
+
+@contextmanager
+def read_primary():
+    """ Reads everything from the primary, even in views using the replica. Used to render the pages
+    auctions.cache stores: a page rendered from a lagging replica right after its namespace expired
+    would be stored under the new version and served until PAGE_TIMEOUT """
+    token = primary_reads.set(True)
+    try:
+        yield
+    finally:
+        primary_reads.reset(token)
+
+
+class ReplicaRouter:
+    """ Sends the reads of views marked with use_replica to the REPLICA_DATABASE alias, unless the client
+    wrote in the last REPLICA_PIN_SECONDS or the page is rendered for the page cache, and every write
+    to the primary. Without REPLICA_DATABASE everything goes to the primary """
+
+    def db_for_read(self, model, **hints):
+        replica = getattr(settings, 'REPLICA_DATABASE', None)
+        if not replica or not replica_reads.get() or primary_reads.get() or model._meta.label_lower not in REPLICA_MODELS:
+            return None
+        state = request_state.get()
+        if state is not None and state.pinned:
+            return None
+        return replica
+
+    def db_for_write(self, model, **hints):
+        state = request_state.get()
+        if state is not None and model._meta.app_label == 'auctions':
+            state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica holds the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return True
@@ -1,90 +1,231 @@
-from .models import Item, Bid, Comment
-from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+from .models import User, Category, Item, Bid, Comment, StoredBlob, POPULARITY_MAX
+from .cache import CATEGORIES, LISTINGS, category_namespace, expire, item_namespaces, user_namespace
+from .middleware import SNAPSHOT_FIELDS, remember_user
+from .jobs import enqueue_renditions
+from django.db.models import Case, Exists, F, OuterRef, Q, Value, When
+from django.conf import settings
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_init, pre_save, post_save, post_delete, m2m_changed
 from django.dispatch import receiver
-from django.core.files import File
-import os
 
 
-# @receiver(post_save, sender=Item)
-# def add_default_image(sender, instance, *args, **kwargs):
-#     """ Set the image property of Item to the default if no image was uploaded on creation """
-#     if not instance.image_url or not os.path.exists(instance.image.path):
-#         instance.image.save('empty.jpg', File(open('auctions/empty.jpg', 'rb')))
+def stored_files(image_name, renditions):
+    """ Storage names of an item image and its renditions """
+    names = [rendition['name'] for rendition in renditions]
+    if image_name:
+        names.append(image_name)
+    return names
+
+
+@receiver(post_init, sender=Item)
+def remember_loaded_image(sender, instance, *args, **kwargs):
+    """ Remembers the image name the item was loaded with, so image changes are detected without a query.
+    It's None when the image column wasn't loaded, and '' for new items given an uploaded file """
+    image = instance.__dict__.get('image')
+    instance._loaded_image = image if image is None or isinstance(image, str) else ''
 
 
 @receiver(post_delete, sender=Item)
-def delete_image_post_delete(sender, instance, *args, **kwargs):
-    """ Deletes item image from images/ folder when the item instance is deleted """
-    try:
-        instance.image.delete(save=False)
-    except:
-        pass
+def release_image_post_delete(sender, instance, *args, **kwargs):
+    """ Releases the item image and its renditions, gc_blobs deletes the files nothing else uses """
+    StoredBlob.objects.release(stored_files(instance.image.name, instance.renditions))
 
 
 @receiver(pre_save, sender=Item)
-def delete_image_update(sender, instance, *args, **kwargs):
-    """ Deletes old image from images/ folder if a new image was uploaded on item edit, otherwise keep old image """
-    try:
-        old_object = instance.__class__.objects.get(id=instance.id)
-        old_image = instance.__class__.objects.get(id=instance.id).image
-        try:
-            new_image = instance.image.path
-
-        # User didn't upload new image
-        except:
-            instance.image = old_image
-        
-        if old_image.path != new_image and new_image is not None:
-            if os.path.exists(old_image.path):
-                os.remove(old_image.path)
-
-    # Don't do anything if there was no old image
-    except:
-        pass
+def track_image_change(sender, instance, update_fields=None, *args, **kwargs):
+    """ Checks whether the image is being replaced or removed, in which case its renditions are dropped
+    and a new image waits for its own """
+    instance._image_changed = False
+    if update_fields is not None and 'image' not in update_fields:
+        return
+
+    # The item was loaded without its image column
+    if getattr(instance, '_loaded_image', '') is None:
+        instance._loaded_image = Item.objects.filter(pk=instance.pk).values_list('image', flat=True).first() or ''
+
+    # A new upload may end up stored under the same name as the old image plus a suffix
+    new_upload = bool(instance.image) and not instance.image._committed
+    instance._image_changed = new_upload or (instance.image.name or '') != instance._loaded_image
+    if instance._image_changed:
+        instance._old_renditions = instance.renditions
+        instance.renditions = []
+        instance.image_pending = bool(instance.image)
+
+
+@receiver(post_save, sender=Item)
+def update_image_references(sender, instance, created, *args, **kwargs):
+    """ Moves the references from the old image and its renditions to the new image when it was
+    replaced or removed, and queues the resizing of the new image. Reference counts change in the
+    same transaction as the item, so a rolled back edit keeps using its files """
+    if not getattr(instance, '_image_changed', False):
+        return
+
+    old_name = '' if created else instance._loaded_image
+    new_name = instance.image.name or ''
+    StoredBlob.objects.release(stored_files(old_name, instance._old_renditions))
+    if new_name:
+        StoredBlob.objects.acquire([new_name])
+        enqueue_renditions(instance)
+
+    # The saved image is now the one stored in the database
+    instance._loaded_image = new_name
+    instance._image_changed = False
 
 
-@receiver(post_save, sender=Bid)
-def update_updated_at_item_on_bid(sender, instance, *args, **kwargs):
-    """ Sets the updated_at attribute of item to the bid_date value of Bid """
-    # print('signal fired')
-    item = instance.item
-    item.updated_at = instance.bid_date
-    # print('setting updated_at from', item.updated_at, 'to', instance.bid_date)
-    item.save()
-    # print('updated_at set to', item.updated_at)
+@receiver(pre_save, sender=Item)
+def record_image_presence(sender, instance, *args, **kwargs):
+    """ Records whether the item has an image, the file is written right after this signal """
+    instance.has_image = bool(instance.image)
 
 
-@receiver(post_save, sender=Comment)
-def update_updated_at_item_on_comment(sender, instance, *args, **kwargs):
-    """ Sets the updated_at attribute of item to the date value of Bid """
-    #print('signal fired')
-    item = instance.item
-    item.updated_at = instance.date
-    #print('setting updated_at from', item.updated_at, 'to', instance.date)
-    item.save()
-    #print('updated_at set to', item.updated_at)
+def increased_popularity():
+    """ Expression adding one to the popularity of an item without going over POPULARITY_MAX """
+    return Case(When(popularity__lt=POPULARITY_MAX, then=F('popularity') + 1), default=F('popularity'))
 
 
 @receiver(post_save, sender=Bid)
-def increase_popularity_count_on_bid(sender, instance, *args, **kwargs):
-    """ Call the increase_popularity item method everytime a bid is made """
+def update_item_on_bid(sender, instance, created, *args, **kwargs):
+    """ Sets updated_at to the bid date, increases popularity and keeps the current_price,
+    bid_count and top_bid columns of the item up to date, all in a single UPDATE.
+    Item.place_bid has already claimed the price of its bids, so a bid equal to the current
+    price still has to be compared with the top bid: like rebuild_bid_totals, equal bids are
+    won by the earliest one """
+    if not created:
+        return
+
+    top_bid_as_high = Bid.objects.filter(pk=OuterRef('top_bid'), bid__gte=instance.bid)
+    higher = (Q(current_price__isnull=True) | Q(current_price__lte=instance.bid)) & ~Exists(top_bid_as_high)
+    Item.objects.filter(pk=instance.item_id).update(
+        updated_at=instance.bid_date,
+        popularity=increased_popularity(),
+        bid_count=F('bid_count') + 1,
+        current_price=Case(When(higher, then=Value(instance.bid)), default=F('current_price'),
+                           output_field=Item._meta.get_field('current_price')),
+        top_bid=Case(When(higher, then=Value(instance.pk)), default=F('top_bid'),
+                     output_field=Item._meta.get_field('top_bid')),
+    )
+
+    # Mirror the new values on the item instance the bid holds, if it was loaded.
+    # Its current_price is the one of its top bid, place_bid only sets the claimed price afterwards
+    if not Bid.item.is_cached(instance):
+        return
     item = instance.item
-    item.increase_popularity()
+    item.updated_at = instance.bid_date
+    item.popularity = min(item.popularity + 1, POPULARITY_MAX)
+    item.bid_count += 1
+    if item.current_price is None or item.current_price < instance.bid:
+        item.current_price = instance.bid
+        item.top_bid = instance
 
 
 @receiver(post_save, sender=Comment)
-def increase_popularity_count_on_comment(sender, instance, *args, **kwargs):
-    """ Call the increase_popularity item method everytime a comment is made """
+def update_item_on_comment(sender, instance, created, *args, **kwargs):
+    """ Sets updated_at to the comment date and increases popularity in a single UPDATE """
+    if not created:
+        return
+
+    Item.objects.filter(pk=instance.item_id).update(updated_at=instance.date, popularity=increased_popularity())
+
+    if not Comment.item.is_cached(instance):
+        return
     item = instance.item
-    item.increase_popularity()
+    item.updated_at = instance.date
+    item.popularity = min(item.popularity + 1, POPULARITY_MAX)
 
 
 @receiver(m2m_changed, sender=Item.watchlist.through)
-def change_popularity_on_watchlist_add(sender, instance, action, *args, **kwargs):
+def change_popularity_on_watchlist_add(sender, instance, action, pk_set, *args, **kwargs):
     """ Call the increase_popularity or decrease_popularity item method 
     everytime the item is added in or removed from someone's watchlist """
-    if action == 'post_add':
+    # pk_set only holds the users that weren't watching yet, adding a watcher twice counts once
+    if action == 'post_add' and pk_set:
         instance.increase_popularity()
 
-    elif action == 'post_remove':
-        instance.decrease_popularity()
\ No newline at end of file
+    # while on removal it holds every user asked for, so the ones actually watching are looked up first
+    elif action == 'pre_remove':
+        instance._watchers_removed = sender.objects.filter(item_id=instance.pk, user_id__in=pk_set).exists()
+
+    elif action == 'post_remove' and getattr(instance, '_watchers_removed', False):
+        instance.decrease_popularity()
+
+
+@receiver(post_init, sender=Item)
+def remember_loaded_category(sender, instance, *args, **kwargs):
+    """ Remembers the category the item was loaded with, so moving it expires both category pages """
+    instance._loaded_category_id = instance.__dict__.get('category_id')
+
+
+def expire_on_commit(*namespaces):
+    """ Expires the namespaces once the running transaction commits. Expiring them before would let
+    a request still reading the old rows store its page under the new versions, until PAGE_TIMEOUT.
+    The namespaces are found right away, so nothing that could fail runs after the commit """
+    transaction.on_commit(lambda: expire(*namespaces))
+
+
+@receiver(post_save, sender=Item)
+def expire_pages_on_item_save(sender, instance, created, *args, **kwargs):
+    expire_on_commit(*item_namespaces(instance))
+    old_category_id = instance._loaded_category_id
+    if not created and old_category_id is not None and old_category_id != instance.category_id:
+        old_name = Category.objects.filter(pk=old_category_id).values_list('category', flat=True).first()
+        expire_on_commit(category_namespace(old_name))
+    instance._loaded_category_id = instance.category_id
+
+
+@receiver(post_delete, sender=Item)
+def expire_pages_on_item_delete(sender, instance, *args, **kwargs):
+    expire_on_commit(*item_namespaces(instance))
+
+
+@receiver(post_save, sender=Bid)
+@receiver(post_save, sender=Comment)
+def expire_pages_on_bid_or_comment(sender, instance, created, *args, **kwargs):
+    """ New bids change the price shown on the cards, and both bids and comments move the item up the listings """
+    if not created:
+        return
+    if sender.item.is_cached(instance):
+        expire_on_commit(*item_namespaces(instance.item))
+    else:
+        name = Item.objects.filter(pk=instance.item_id).values_list('category__category', flat=True).first()
+        expire_on_commit(LISTINGS, category_namespace(name))
+
+
+@receiver(m2m_changed, sender=Item.watchlist.through)
+def expire_pages_on_watchlist_change(sender, instance, action, *args, **kwargs):
+    """ Watchlist changes move the item on the populars page """
+    if action in ('post_add', 'post_remove'):
+        expire_on_commit(*item_namespaces(instance))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def expire_pages_on_category_change(sender, instance, *args, **kwargs):
+    expire_on_commit(CATEGORIES, category_namespace(instance.category))
+
+
+@receiver(user_logged_in)
+def remember_user_on_login(sender, request, user, *args, **kwargs):
+    """ Takes the session snapshot of the user right away, so the next request needs no users query """
+    remember_user(request.session, user)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def expire_user_snapshots(sender, instance, update_fields=None, *args, **kwargs):
+    """ Saving a user outdates the snapshots in its sessions, so they are checked against the database again.
+    Saves that only touch other columns, like last_login on every login, keep them """
+    if update_fields is not None and not set(update_fields) & {*SNAPSHOT_FIELDS, 'password'}:
+        return
+    expire_on_commit(user_namespace(instance.pk))
+
+
+@receiver(connection_created)
+def apply_sqlite_pragmas(sender, connection, *args, **kwargs):
+    """ Tunes every new SQLite connection with the SQLITE_PRAGMAS setting """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {name} = {value}')
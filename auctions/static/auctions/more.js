@@ -0,0 +1,13 @@
+// Loads the next page of bids or comments in place of its "Show older" link
+document.addEventListener('click', event => {
+    const link = event.target.closest('.more-link');
+    if (!link) {
+        return;
+    }
+    event.preventDefault();
+
+    fetch(link.href)
+        .then(response => response.ok ? response.text() : Promise.reject(response))
+        .then(html => link.closest('.more-wrapper').outerHTML = html)
+        .catch(() => window.location = link.href);
+});
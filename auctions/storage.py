@@ -0,0 +1,53 @@
+from django.core.files.storage import FileSystemStorage
+import hashlib
+import os
+import re
+import uuid
+
+
+# ab/cd/abcd...ef.jpg
+CONTENT_NAME = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """ Stores every file under the sha256 of its content, sharded in two levels of folders
+    (ab/cd/abcd...ef.jpg), whatever name it's saved with. Saving content that is already
+    stored writes nothing and returns the existing name.
+    Files are registered as StoredBlob rows, their reference counts tell the gc_blobs
+    command which files nothing uses anymore. Files are never deleted here """
+
+    def get_available_name(self, name, max_length=None):
+        # equal names mean equal content, there's nothing to avoid overwriting
+        return name
+
+    def content_name(self, name, content):
+        """ Storage name of the content, keeping the extension of the given name """
+        # uploads are hashed while they're received
+        digest = getattr(content, 'sha256', None)
+        if digest is None:
+            sha256 = hashlib.sha256()
+            for chunk in content.chunks():
+                sha256.update(chunk)
+            digest = sha256.hexdigest()
+            content.seek(0)
+
+        extension = os.path.splitext(name)[1].lower()
+        return f'{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+    def _save(self, name, content):
+        from .models import StoredBlob
+
+        name = self.content_name(name, content)
+        # gc_blobs deletes a row and its file in one transaction, so a file whose row
+        # is missing may be deleted right before this, even if it exists at this point
+        created = StoredBlob.objects.register(name)
+        if created or not self.exists(name):
+            # written under a unique name first, so a concurrent save of the same content just replaces it
+            temporary = super()._save(f'{name}.{uuid.uuid4().hex}.tmp', content)
+            os.replace(self.path(temporary), self.path(name))
+        return name
+
+
+def is_content_name(name):
+    """ Whether a storage name was derived from the file content, so the file never changes """
+    return bool(CONTENT_NAME.match(name))
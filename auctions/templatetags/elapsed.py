@@ -0,0 +1,16 @@
+from django import template
+from ..timesince import elapsed_since
+import time
+
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def elapsed(context, moment):
+    """ Age of a datetime, i.e. {% elapsed bid.bid_date %}. Every age on a page is measured
+    against the same now, taken the first time the tag renders """
+    render_context = context.render_context
+    if 'elapsed_now' not in render_context:
+        render_context['elapsed_now'] = time.time()
+    return elapsed_since([moment], render_context['elapsed_now'])[0]
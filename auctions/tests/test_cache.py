@@ -0,0 +1,164 @@
+from django.test import TestCase, Client
+from django.core.cache import cache
+from django.urls import reverse
+from auctions.models import Category, User, Item, Comment
+from auctions.cache import get_versions, expire, now_ms
+
+
+class PageCacheTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user(username='seller', password='seller')
+        self.buyer = User.objects.create_user(username='buyer', password='buyer')
+        self.house = Category.objects.create(category='House')
+        self.other = Category.objects.create(category='Other')
+        self.item = Item.objects.create(name='lamp', starting_price=20, user=self.seller, category=self.house)
+        Item.objects.create(name='chair', starting_price=30, user=self.seller, category=self.other)
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_anonymous_page_cached(self):
+        """ Anonymous visitors get the stored page without any query """
+        client = Client()
+        first = client.get(reverse('index'))
+        with self.assertNumQueries(0):
+            second = client.get(reverse('index'))
+
+        self.assertEqual(first.content, second.content)
+        self.assertIn('Cookie', second['Vary'])
+
+    def test_pages_cached_per_path(self):
+        """ Every page of a listing is stored apart """
+        client = Client()
+        client.get(reverse('index'))
+        response = client.get(reverse('index'), {'size': 1})
+        self.assertEqual(len(response.context['items']), 1)
+
+    def test_authenticated_not_cached(self):
+        """ Logged in users always get their own page """
+        Client().get(reverse('index'))
+        client = Client()
+        client.login(username='buyer', password='buyer')
+        response = client.get(reverse('index'))
+
+        self.assertContains(response, 'Welcome <strong>buyer</strong>')
+
+    def test_bid_expires_listings(self):
+        """ New bids show up on the listings right away """
+        client = Client()
+        client.get(reverse('index'))
+        client.get(reverse('populars'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.place_bid(self.buyer, 25)
+
+        self.assertContains(client.get(reverse('index')), 'Current bid: <strong>$25.00</strong>')
+        self.assertContains(client.get(reverse('populars')), 'Current bid: <strong>$25.00</strong>')
+        self.assertContains(client.get(reverse('category_page', args=['House'])), 'Current bid: <strong>$25.00</strong>')
+
+    def test_other_category_kept(self):
+        """ Changes to an item only expire the page of its own category """
+        client = Client()
+        client.get(reverse('category_page', args=['House']))
+        client.get(reverse('category_page', args=['Other']))
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(comment='nice', user=self.buyer, item=self.item)
+
+        with self.assertNumQueries(0):
+            client.get(reverse('category_page', args=['Other']))
+        response = client.get(reverse('category_page', args=['House']))
+        self.assertIsNotNone(response.context)
+
+    def test_moved_item_expires_both_categories(self):
+        """ Moving an item to another category expires the pages of both """
+        client = Client()
+        client.get(reverse('category_page', args=['House']))
+        client.get(reverse('category_page', args=['Other']))
+        item = Item.objects.get(pk=self.item.pk)
+        item.category = self.other
+        with self.captureOnCommitCallbacks(execute=True):
+            item.save()
+
+        self.assertNotContains(client.get(reverse('category_page', args=['House'])), 'lamp')
+        self.assertContains(client.get(reverse('category_page', args=['Other'])), 'lamp')
+
+    def test_watchlist_expires_populars(self):
+        """ Watchlist changes reorder the populars page """
+        client = Client()
+        client.get(reverse('populars'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.watchlist.add(self.buyer)
+
+        response = client.get(reverse('populars'))
+        self.assertIsNotNone(response.context)
+        self.assertEqual(response.context['items'][0].name, 'lamp')
+
+    def test_deleted_item_expires_listings(self):
+        client = Client()
+        client.get(reverse('index'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.delete()
+        self.assertNotContains(client.get(reverse('index')), 'lamp')
+
+    def test_new_category_expires_category_list(self):
+        client = Client()
+        client.get(reverse('category'))
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(category='Garden')
+        self.assertContains(client.get(reverse('category')), 'Garden')
+
+    def test_expired_on_commit(self):
+        """ Pages are expired once the bid commits: a page rendered before that, still showing the old
+        price, is stored under the old versions and not served afterwards """
+        client = Client()
+        client.get(reverse('index'))
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.item.place_bid(self.buyer, 25)
+            self.assertNotContains(client.get(reverse('index')), '$25.00')
+        self.assertEqual(len(callbacks), 1)
+
+        callbacks[0]()
+        self.assertContains(client.get(reverse('index')), 'Current bid: <strong>$25.00</strong>')
+
+    def test_versions_start_from_current_time(self):
+        """ Missing versions start from the current time in milliseconds, and expiring bumps them """
+        before = now_ms()
+        version, = get_versions(['fresh'])
+        self.assertGreaterEqual(version, before)
+
+        expire('fresh')
+        self.assertEqual(get_versions(['fresh']), [version + 1])
+
+        cache.delete('version:fresh')
+        expire('fresh')
+        self.assertGreaterEqual(get_versions(['fresh'])[0], before)
+
+    def test_item_cards_cached(self):
+        """ Cards are rendered again only once their item is updated """
+        client = Client()
+        client.login(username='buyer', password='buyer')
+        client.get(reverse('index'))
+
+        # queryset updates leave updated_at alone, so the stored card is still used
+        Item.objects.filter(pk=self.item.pk).update(name='table')
+        self.assertContains(client.get(reverse('index')), 'lamp')
+
+        item = Item.objects.get(pk=self.item.pk)
+        item.save()
+        response = client.get(reverse('index'))
+        self.assertContains(response, 'table')
+        self.assertNotContains(response, 'lamp')
+
+    def test_item_cards_show_renames(self):
+        """ Renaming the seller or the category of an item renders its card again """
+        client = Client()
+        client.login(username='buyer', password='buyer')
+        client.get(reverse('index'))
+
+        User.objects.filter(pk=self.seller.pk).update(username='vendor')
+        Category.objects.filter(pk=self.house.pk).update(category='Home')
+        response = client.get(reverse('index'))
+        self.assertContains(response, '<strong>vendor</strong>')
+        self.assertContains(response, '<strong>Home</strong>')
+        self.assertNotContains(response, '<strong>House</strong>')
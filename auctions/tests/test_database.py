@@ -0,0 +1,238 @@
+from django.test import TestCase, Client, SimpleTestCase, override_settings
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from auctions.models import Category, User, Item, Bid, Comment
+from auctions.routers import PIN_COOKIE, ReplicaRouter, RequestState, primary_reads, replica_reads, request_state
+import os
+import shutil
+import tempfile
+
+
+class SQLitePragmasTestCase(TestCase):
+
+    def pragmas(self, *names, database=None):
+        """ Values of the pragmas on a brand new connection, to the test database or to a database file """
+        new_connection = connection.copy()
+        if database:
+            new_connection.settings_dict['NAME'] = database
+        try:
+            with new_connection.cursor() as cursor:
+                values = []
+                for name in names:
+                    cursor.execute(f'PRAGMA {name}')
+                    values.append(cursor.fetchone()[0])
+                return values
+        finally:
+            new_connection.close()
+
+    def test_pragmas_applied(self):
+        """ Every new connection is tuned with SQLITE_PRAGMAS """
+        # 1 is NORMAL
+        self.assertEqual(self.pragmas('synchronous', 'busy_timeout', 'cache_size'), [1, 20000, -20000])
+
+    @override_settings(SQLITE_PRAGMAS={'cache_size': -1000})
+    def test_pragmas_from_settings(self):
+        self.assertEqual(self.pragmas('cache_size'), [-1000])
+
+    def test_database_file_in_wal_mode(self):
+        """ Database files are switched to WAL, in-memory test databases can't use it """
+        directory = tempfile.mkdtemp()
+        database = os.path.join(directory, 'db.sqlite3')
+        try:
+            self.assertEqual(self.pragmas('journal_mode', database=database), ['wal'])
+        finally:
+            shutil.rmtree(directory)
+
+
+@override_settings(REPLICA_DATABASE='replica')
+class ReplicaRouterTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+
+    def read_with_replica(self, model, state=None):
+        """ Where the model is read from inside a view using the replica """
+        replica_token = replica_reads.set(True)
+        state_token = request_state.set(state)
+        try:
+            return self.router.db_for_read(model)
+        finally:
+            request_state.reset(state_token)
+            replica_reads.reset(replica_token)
+
+    def test_replica_views_read_replica(self):
+        self.assertEqual(self.read_with_replica(Item), 'replica')
+        self.assertEqual(self.read_with_replica(Item.watchlist.through), 'replica')
+        self.assertIsNone(self.router.db_for_read(Item))
+
+    def test_users_read_from_primary(self):
+        """ Users and sessions must never lag behind, they are read from the primary """
+        self.assertIsNone(self.read_with_replica(User))
+
+    def test_pinned_read_from_primary(self):
+        self.assertIsNone(self.read_with_replica(Item, RequestState(pinned=True)))
+
+    def test_cached_pages_read_primary(self):
+        token = primary_reads.set(True)
+        try:
+            self.assertIsNone(self.read_with_replica(Item))
+        finally:
+            primary_reads.reset(token)
+
+    def test_writes_to_primary(self):
+        """ Writes go to the primary and are remembered on the request """
+        state = RequestState()
+        token = request_state.set(state)
+        try:
+            self.assertEqual(self.router.db_for_write(Bid), 'default')
+        finally:
+            request_state.reset(token)
+        self.assertTrue(state.wrote)
+
+    @override_settings(REPLICA_DATABASE=None)
+    def test_without_replica(self):
+        self.assertIsNone(self.read_with_replica(Item))
+
+
+@override_settings(REPLICA_DATABASE='replica', REPLICA_PIN_SECONDS=10)
+class ReplicaRoutingTestCase(TestCase):
+    """ The two test databases stand for the primary and a replica the replication tool copies it to """
+
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        seller = User.objects.create_user(username='seller', password='seller')
+        User.objects.create_user(username='buyer', password='buyer')
+        self.item = Item.objects.create(name='lamp', starting_price=20, user=seller, category=Category.objects.create(category='Other'))
+        self.replicate()
+
+        # written after the last replication
+        self.new_item = Item.objects.create(name='chair', starting_price=30, user=seller, category=self.item.category)
+
+    def tearDown(self):
+        cache.clear()
+
+    def replicate(self):
+        """ Copies the rows of the primary to the replica """
+        for model in (User, Category, Item, Bid, Comment):
+            model.objects.using('replica').bulk_create(model.objects.using('default').all())
+
+    def test_listings_read_replica(self):
+        client = Client()
+        client.login(username='buyer', password='buyer')
+        response = client.get(reverse('index'))
+        self.assertContains(response, 'lamp')
+        self.assertNotContains(response, 'chair')
+
+        response = Client().get(reverse('item', args=(self.new_item.id,)))
+        self.assertEqual(response.status_code, 404)
+
+    def test_cached_pages_read_primary(self):
+        """ Pages stored for anonymous visitors are rendered from the primary, a lagging
+        replica would keep them stale until PAGE_TIMEOUT """
+        for url in (reverse('index'), reverse('populars'), reverse('category_page', args=['Other'])):
+            self.assertContains(Client().get(url), 'chair')
+
+    def test_read_your_writes(self):
+        """ Clients read from the primary for a while after writing, others keep reading the replica """
+        client = Client()
+        client.login(username='buyer', password='buyer')
+        response = client.post(reverse('comment', args=(self.item.id,)), {'comment': 'nice lamp'})
+
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], 10)
+        self.assertFalse(Comment.objects.using('replica').exists())
+        self.assertContains(client.get(reverse('item', args=(self.item.id,))), 'nice lamp')
+
+        other = Client()
+        other.login(username='seller', password='seller')
+        self.assertNotContains(other.get(reverse('item', args=(self.item.id,))), 'nice lamp')
+
+    def test_reads_dont_pin(self):
+        client = Client()
+        client.login(username='buyer', password='buyer')
+        response = client.get(reverse('item', args=(self.item.id,)))
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    @override_settings(REPLICA_DATABASE=None)
+    def test_without_replica(self):
+        """ Everything is read from the primary unless a replica is configured """
+        client = Client()
+        client.login(username='buyer', password='buyer')
+        self.assertContains(client.get(reverse('index')), 'chair')
+
+
+class QueryPlanTestCase(TestCase):
+    """ The listing and detail queries walk an index in their order, they neither scan nor sort the table """
+
+    def setUp(self):
+        # cached listing pages would skip the queries
+        cache.clear()
+        self.category = Category.objects.create(category='Other')
+        self.seller = User.objects.create_user(username='seller', password='seller')
+        buyer = User.objects.create_user(username='buyer', password='buyer')
+        for i in range(3):
+            item = Item.objects.create(name=f'item{i}', starting_price=10, user=self.seller, category=self.category)
+        self.item = item
+        for i in range(3):
+            item.place_bid(buyer, 20 + i)
+            Comment.objects.create(comment=f'comment {i}', user=buyer, item=item)
+        self.client = Client()
+        self.client.login(username='seller', password='seller')
+
+    def tearDown(self):
+        cache.clear()
+
+    def plans(self, url, table, params=None):
+        """ Query plans of the ordered queries the page runs on the table """
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+
+        plans = []
+        for query in context.captured_queries:
+            if f'FROM "{table}"' in query['sql'] and 'ORDER BY' in query['sql']:
+                with connection.cursor() as cursor:
+                    cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                    plans.append([row[-1] for row in cursor.fetchall()])
+        self.assertTrue(plans)
+        return plans
+
+    def assertUsesIndex(self, plan, table, index=None):
+        steps = [step for step in plan if f' {table} ' in f'{step} ']
+        self.assertTrue(steps, plan)
+        for step in steps:
+            self.assertIn('USING INDEX' if index is None else f'USING INDEX {index}', step)
+        self.assertFalse(any('TEMP B-TREE' in step for step in plan), plan)
+
+    def test_listings(self):
+        pages = [
+            (reverse('index'), 'item_active_updated_idx'),
+            (reverse('populars'), 'item_active_popular_idx'),
+            (reverse('category_page', args=('Other',)), 'item_category_updated_idx'),
+            (reverse('my_items'), 'item_user_created_idx'),
+        ]
+        for url, index in pages:
+            with self.subTest(url=url):
+                for plan in self.plans(url, 'auctions_item', {'size': 2}):
+                    self.assertUsesIndex(plan, 'auctions_item', index)
+
+    def test_next_pages(self):
+        """ Pages after the first one keep walking the same index from the cursor """
+        page = self.client.get(reverse('index'), {'size': 1}).context['page']
+        for plan in self.plans(reverse('index'), 'auctions_item', {'cursor': page.next_cursor, 'size': 1}):
+            self.assertUsesIndex(plan, 'auctions_item', 'item_active_updated_idx')
+
+        bids = self.client.get(reverse('item_bids', args=(self.item.id,)), {'size': 1}).context['bids']
+        for plan in self.plans(reverse('item_bids', args=(self.item.id,)), 'auctions_bid', {'cursor': bids.next_cursor}):
+            self.assertUsesIndex(plan, 'auctions_bid', 'bid_item_bid_idx')
+
+    def test_item_page(self):
+        """ Bids use their composite index, comments the item index which ends with the rowid on SQLite """
+        url = reverse('item', args=(self.item.id,))
+        for plan in self.plans(url, 'auctions_bid'):
+            self.assertUsesIndex(plan, 'auctions_bid', 'bid_item_bid_idx')
+        for plan in self.plans(url, 'auctions_comment'):
+            self.assertUsesIndex(plan, 'auctions_comment')
@@ -0,0 +1,147 @@
+from django.test import TestCase, override_settings
+from django.core.files import File
+from django.core.management import call_command
+from auctions.models import Category, User, Item, StoredBlob
+from auctions.images import create_renditions, update_renditions
+from auctions.jobs import process_pending_jobs
+from PIL import Image
+from io import StringIO
+from unittest import mock
+import os
+
+
+@override_settings(IMAGE_JOB_WORKERS=0)
+class RenditionsTestCase(TestCase):
+
+    def setUp(self):
+        testuser = User.objects.create_user(username="testuser", password="asdf")
+        other = Category.objects.create(category="Other")
+
+        # 800x2000 transparent PNG
+        item_large = Item(user=testuser, name="large", starting_price=50, category=other)
+        item_large.image.save('lionheart.png', File(open('auctions/lionheart.png', 'rb')))
+
+        # 150x176 JPEG
+        item_small = Item(user=testuser, name="small", starting_price=50, category=other)
+        item_small.image.save('download.jpg', File(open('auctions/download.jpg', 'rb')))
+
+        Item.objects.create(user=testuser, name="no_img", starting_price=22, category=other)
+
+    def tearDown(self):
+        for item in Item.objects.all():
+            if item.image:
+                item.image.storage.delete(item.image.name)
+            for rendition in item.renditions:
+                item.image.storage.delete(rendition['name'])
+
+    def test_create_renditions(self):
+        """ Large images get a WebP and a PNG copy per width, never wider than the original """
+        item = Item.objects.get(name="large")
+        renditions = create_renditions(item.image)
+        item.renditions = renditions
+        item.save()
+
+        self.assertEqual(
+            [(rendition['width'], rendition['format']) for rendition in renditions],
+            [(320, 'webp'), (320, 'png'), (800, 'webp'), (800, 'png')]
+        )
+        for rendition in renditions:
+            with Image.open(item.image.storage.path(rendition['name'])) as image:
+                self.assertEqual(image.format, rendition['format'].upper())
+                self.assertEqual(image.width, rendition['width'])
+
+    def test_small_image_not_upscaled(self):
+        """ Images narrower than the card width keep their size """
+        item = Item.objects.get(name="small")
+        update_renditions(item)
+        item.refresh_from_db()
+
+        self.assertEqual(
+            [(rendition['width'], rendition['format']) for rendition in item.renditions],
+            [(150, 'webp'), (150, 'jpeg')]
+        )
+        self.assertEqual(item.card_image_url, item.image.storage.url(item.renditions[1]['name']))
+
+    def test_srcset(self):
+        """ srcset attributes list every rendition url with its width """
+        item = Item.objects.get(name="large")
+        update_renditions(item)
+        url = item.image.storage.url
+        webp_320, png_320, webp_800, png_800 = [rendition['name'] for rendition in item.renditions]
+
+        self.assertEqual(item.image_srcset, f"{url(png_320)} 320w, {url(png_800)} 800w")
+        self.assertEqual(item.image_webp_srcset, f"{url(webp_320)} 320w, {url(webp_800)} 800w")
+        self.assertTrue(png_320.endswith('.png') and webp_800.endswith('.webp'))
+
+    def test_no_renditions(self):
+        """ Cards show the placeholder until the renditions are ready """
+        item = Item.objects.get(name="small")
+        self.assertEqual(item.image_srcset, '')
+        self.assertEqual(item.card_image_url, '')
+        self.assertTrue(item.image_processing)
+        self.assertEqual(Item.objects.get(name="no_img").card_image_url, '')
+        self.assertFalse(Item.objects.get(name="no_img").image_processing)
+
+    def test_renditions_created_by_job(self):
+        """ Uploading an image queues a job that creates its renditions """
+        item = Item.objects.get(name="no_img")
+        item.image = File(open('auctions/images.jpg', 'rb'), name='images.jpg')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            item.save()
+        item.refresh_from_db()
+        self.assertEqual(item.renditions, [])
+
+        process_pending_jobs()
+        item.refresh_from_db()
+        self.assertEqual(len(item.renditions), 2)
+
+    def test_replaced_image_drops_renditions(self):
+        """ Replacing the image releases the renditions of the old one, for gc_blobs to delete """
+        item = Item.objects.get(name="small")
+        update_renditions(item)
+        old_names = [rendition['name'] for rendition in item.renditions]
+        old_paths = [item.image.storage.path(name) for name in old_names]
+        self.assertEqual([blob.refs for blob in StoredBlob.objects.filter(name__in=old_names)], [1, 1])
+        item.image = File(open('auctions/images.jpg', 'rb'), name='images.jpg')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            item.save()
+        process_pending_jobs()
+
+        item.refresh_from_db()
+        self.assertEqual([blob.refs for blob in StoredBlob.objects.filter(name__in=old_names)], [0, 0])
+        self.assertEqual(len(item.renditions), 2)
+
+        call_command('gc_blobs', '--grace', '0', stdout=StringIO())
+        self.assertTrue(all(not os.path.exists(path) for path in old_paths))
+
+    def test_build_renditions_command(self):
+        """ The command backfills the renditions of items with images """
+        call_command('build_renditions', stdout=StringIO())
+
+        self.assertEqual(len(Item.objects.get(name="large").renditions), 4)
+        self.assertEqual(len(Item.objects.get(name="small").renditions), 2)
+        self.assertEqual(Item.objects.get(name="no_img").renditions, [])
+
+    def test_build_renditions_image_replaced(self):
+        """ Renditions of an image replaced while the command resizes it are only released once,
+        so the other items sharing them keep them """
+        item = Item.objects.get(name="small")
+        copy = Item(user=item.user, name="copy", starting_price=50, category=item.category)
+        copy.image.save('download.jpg', File(open('auctions/download.jpg', 'rb')))
+        update_renditions(item)
+        update_renditions(copy)
+        names = [rendition['name'] for rendition in item.renditions]
+
+        def replace_image(image_field):
+            renditions = create_renditions(image_field)
+            replaced = Item.objects.get(pk=item.pk)
+            replaced.image = None
+            replaced.save()
+            return renditions
+
+        with mock.patch('auctions.images.create_renditions', side_effect=replace_image):
+            call_command('build_renditions', str(item.pk), '--force', stdout=StringIO())
+
+        self.assertEqual([blob.refs for blob in StoredBlob.objects.filter(name__in=names)], [1, 1])
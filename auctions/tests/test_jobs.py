@@ -0,0 +1,175 @@
+from django.test import TestCase, override_settings
+from django.core.files import File
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+from auctions.models import Category, User, Item, ImageJob
+from auctions.jobs import process_pending_jobs, MAX_ATTEMPTS, RETRY_DELAY
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+
+@override_settings(IMAGE_JOB_WORKERS=0)
+class ImageJobTestCase(TestCase):
+
+    def setUp(self):
+        testuser = User.objects.create_user(username="testuser", password="asdf")
+        other = Category.objects.create(category="Other")
+
+        item = Item(user=testuser, name="small", starting_price=50, category=other)
+        with self.captureOnCommitCallbacks(execute=True):
+            item.image.save('download.jpg', File(open('auctions/download.jpg', 'rb')))
+
+    def tearDown(self):
+        for item in Item.objects.all():
+            if item.image:
+                item.image.storage.delete(item.image.name)
+            for rendition in item.renditions:
+                item.image.storage.delete(rendition['name'])
+
+    def test_upload_enqueues_job(self):
+        """ Saving an item with a new image stores a pending job for it """
+        item = Item.objects.get(name="small")
+        job = ImageJob.objects.get()
+
+        self.assertEqual(job.item, item)
+        self.assertEqual(job.image, item.image.name)
+        self.assertEqual(job.status, ImageJob.PENDING)
+        self.assertEqual(item.renditions, [])
+
+    def test_save_without_new_image(self):
+        """ Edits that keep the image don't queue more jobs """
+        item = Item.objects.get(name="small")
+        item.name = "renamed"
+        item.save()
+        self.assertEqual(ImageJob.objects.count(), 1)
+
+    def test_process_job(self):
+        """ Running the job creates the renditions and marks it done """
+        self.assertEqual(process_pending_jobs(), 1)
+
+        job = ImageJob.objects.get()
+        self.assertEqual(job.status, ImageJob.DONE)
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNone(job.locked_until)
+        self.assertEqual(len(Item.objects.get(name="small").renditions), 2)
+        self.assertEqual(process_pending_jobs(), 0)
+
+    def test_failed_job_retried(self):
+        """ A failing job goes back to pending, waiting longer after each attempt """
+        with mock.patch('auctions.jobs.update_renditions', side_effect=OSError("broken")), \
+                self.assertLogs('auctions.jobs', 'ERROR'):
+            before = timezone.now()
+            process_pending_jobs()
+            job = ImageJob.objects.get()
+            self.assertEqual(job.status, ImageJob.PENDING)
+            self.assertEqual(job.attempts, 1)
+            self.assertIn("broken", job.last_error)
+            self.assertGreaterEqual(job.run_after, before + RETRY_DELAY)
+
+            # Not due yet
+            self.assertEqual(process_pending_jobs(), 0)
+
+            ImageJob.objects.update(run_after=timezone.now())
+            before = timezone.now()
+            process_pending_jobs()
+            job.refresh_from_db()
+            self.assertEqual(job.attempts, 2)
+            self.assertGreaterEqual(job.run_after, before + 2 * RETRY_DELAY)
+
+    def test_job_fails_after_max_attempts(self):
+        """ Jobs stop being retried after MAX_ATTEMPTS """
+        ImageJob.objects.update(attempts=MAX_ATTEMPTS - 1)
+        with mock.patch('auctions.jobs.update_renditions', side_effect=OSError("broken")), \
+                self.assertLogs('auctions.jobs', 'ERROR'):
+            process_pending_jobs()
+
+        job = ImageJob.objects.get()
+        self.assertEqual(job.status, ImageJob.FAILED)
+        self.assertEqual(job.attempts, MAX_ATTEMPTS)
+        self.assertEqual(process_pending_jobs(), 0)
+
+    def test_expired_lease_reclaimed(self):
+        """ Running jobs are only run again once their worker's lease expires """
+        ImageJob.objects.update(status=ImageJob.RUNNING, attempts=1, locked_until=timezone.now() + timedelta(minutes=1))
+        self.assertEqual(process_pending_jobs(), 0)
+
+        ImageJob.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(process_pending_jobs(), 1)
+        job = ImageJob.objects.get()
+        self.assertEqual(job.status, ImageJob.DONE)
+        self.assertEqual(job.attempts, 2)
+
+    def test_crashed_last_attempt_fails(self):
+        """ A job whose worker crashed on its last attempt fails instead of being run again,
+        and its item shows the original image """
+        ImageJob.objects.update(status=ImageJob.RUNNING, attempts=MAX_ATTEMPTS, locked_until=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(process_pending_jobs(), 0)
+        job = ImageJob.objects.get()
+        self.assertEqual(job.status, ImageJob.FAILED)
+        self.assertIsNone(job.locked_until)
+        self.assertFalse(Item.objects.get(name="small").image_processing)
+
+    def test_replaced_image_skipped(self):
+        """ Jobs of an image that was replaced don't resize anything """
+        item = Item.objects.get(name="small")
+        item.image = None
+        with self.captureOnCommitCallbacks(execute=True):
+            item.save()
+
+        with mock.patch('auctions.jobs.update_renditions') as update_renditions:
+            process_pending_jobs()
+
+        update_renditions.assert_not_called()
+        self.assertEqual(ImageJob.objects.get().status, ImageJob.DONE)
+
+    def test_process_image_jobs_command(self):
+        """ The command runs every pending job """
+        call_command('process_image_jobs', '--once', stdout=StringIO())
+        self.assertEqual(ImageJob.objects.get().status, ImageJob.DONE)
+
+    def test_placeholder_while_processing(self):
+        """ Listings and the item page show the placeholder until the renditions exist """
+        item = Item.objects.get(name="small")
+
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'empty.jpg')
+        self.assertContains(response, 'image-processing')
+        response = self.client.get(reverse('item', args=[item.id]))
+        self.assertContains(response, 'image-processing')
+
+        process_pending_jobs()
+        item.refresh_from_db()
+        response = self.client.get(reverse('index'))
+        self.assertNotContains(response, 'image-processing')
+        self.assertContains(response, item.renditions[1]['name'])
+        response = self.client.get(reverse('item', args=[item.id]))
+        self.assertNotContains(response, 'image-processing')
+
+    def test_original_after_failed_job(self):
+        """ Once its job gives up, the item shows its original image instead of the placeholder """
+        item = Item.objects.get(name="small")
+        self.client.get(reverse('index'))
+        ImageJob.objects.update(attempts=MAX_ATTEMPTS - 1)
+        with mock.patch('auctions.jobs.update_renditions', side_effect=OSError("broken")), \
+                self.assertLogs('auctions.jobs', 'ERROR'):
+            process_pending_jobs()
+
+        item.refresh_from_db()
+        self.assertFalse(item.image_processing)
+        for url in (reverse('index'), reverse('item', args=[item.id])):
+            response = self.client.get(url)
+            self.assertNotContains(response, 'image-processing')
+            self.assertContains(response, item.image.url)
+
+    def test_original_without_job(self):
+        """ Items whose image never got a job, like the ones uploaded before renditions existed, show the original """
+        item = Item.objects.get(name="small")
+        Item.objects.filter(pk=item.pk).update(image_pending=False)
+        ImageJob.objects.all().delete()
+
+        response = self.client.get(reverse('item', args=[item.id]))
+        self.assertNotContains(response, 'image-processing')
+        self.assertContains(response, item.image.url)
@@ -0,0 +1,94 @@
+from django.test import TestCase, Client
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from auctions.models import Category, User, Item
+from auctions.middleware import SNAPSHOT_KEY, SNAPSHOT_TIMEOUT
+from unittest import mock
+
+
+class CachedAuthenticationTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.buyer = User.objects.create_user(username='buyer', password='buyer')
+        seller = User.objects.create_user(username='seller', password='seller')
+        Item.objects.create(name='lamp', starting_price=20, user=seller, category=Category.objects.create(category='Other'))
+        self.client = Client()
+        self.client.login(username='buyer', password='buyer')
+
+    def tearDown(self):
+        cache.clear()
+
+    def get_watchlist(self):
+        """ Queries of a watchlist request, and its response """
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('watchlist'))
+        return [query['sql'] for query in context.captured_queries], response
+
+    def test_user_from_session(self):
+        """ Logged in users are built from their session, the users table isn't read """
+        queries, response = self.get_watchlist()
+
+        self.assertFalse(any('FROM "auctions_user"' in sql for sql in queries))
+        self.assertEqual(response.context['user'], self.buyer)
+        self.assertContains(response, 'Welcome <strong>buyer</strong>')
+
+    def test_saved_user_loaded_again(self):
+        """ Saving the user outdates the snapshot, the next request loads the user and takes a new one """
+        self.buyer.username = 'renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.buyer.save()
+
+        queries, response = self.get_watchlist()
+        self.assertTrue(any('FROM "auctions_user"' in sql for sql in queries))
+        self.assertContains(response, 'Welcome <strong>renamed</strong>')
+
+        queries, response = self.get_watchlist()
+        self.assertFalse(any('FROM "auctions_user"' in sql for sql in queries))
+        self.assertContains(response, 'Welcome <strong>renamed</strong>')
+
+    def test_password_change_logs_out(self):
+        """ Changing the password still ends the other sessions of the user """
+        self.buyer.set_password('changed')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.buyer.save()
+
+        response = self.client.get(reverse('watchlist'))
+        self.assertRedirects(response, reverse('login'))
+
+    def test_expired_on_commit(self):
+        """ Snapshots are expired once the user change commits, a request still reading the old
+        user meanwhile takes a snapshot that the expiry outdates """
+        self.buyer.is_active = False
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.buyer.save()
+        self.assertEqual(len(callbacks), 1)
+
+        callbacks[0]()
+        self.assertRedirects(self.client.get(reverse('watchlist')), reverse('login'))
+
+    def test_last_login_keeps_snapshots(self):
+        """ Logging in from elsewhere only updates last_login, the other sessions keep their snapshot """
+        Client().login(username='buyer', password='buyer')
+
+        queries, response = self.get_watchlist()
+        self.assertFalse(any('FROM "auctions_user"' in sql for sql in queries))
+
+    def test_snapshot_timeout(self):
+        """ Snapshots are only trusted for SNAPSHOT_TIMEOUT seconds """
+        taken_at = self.client.session[SNAPSHOT_KEY]['taken_at']
+        with mock.patch('auctions.middleware.time.time', return_value=taken_at + SNAPSHOT_TIMEOUT):
+            queries, response = self.get_watchlist()
+
+        self.assertTrue(any('FROM "auctions_user"' in sql for sql in queries))
+        self.assertGreater(self.client.session[SNAPSHOT_KEY]['taken_at'], taken_at)
+
+    def test_other_columns_loaded_on_use(self):
+        """ Columns left out of the snapshot are loaded the first time they are used """
+        self.client.get(reverse('watchlist'))
+        user = self.client.get(reverse('watchlist')).context['user']
+
+        self.assertEqual(user.username, 'buyer')
+        self.assertTrue(user.check_password('buyer'))
@@ -1,10 +1,27 @@
-from django.test import TestCase
-from auctions.models import Category, User, Item
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.db import connection, transaction, IntegrityError, OperationalError
+from auctions.models import Category, User, Item, Bid, StoredBlob, POPULARITY_MAX
 from django.core.files import File
+from django.core.management import call_command
+from decimal import Decimal
+from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import random
+import threading
+import time
 import os
 
 
 
+def content_name(path):
+    """ Name the content-addressed storage gives to a file """
+    with open(path, 'rb') as file:
+        digest = hashlib.sha256(file.read()).hexdigest()
+    return f'{digest[:2]}/{digest[2:4]}/{digest}{os.path.splitext(path)[1]}'
+
+
+@override_settings(IMAGE_JOB_WORKERS=0)
 class ItemTestCase(TestCase):
 
     def setUp(self):
@@ -33,16 +50,80 @@ class ItemTestCase(TestCase):
                 os.remove(item.image.path)
             except:
                 pass
+            for rendition in item.renditions:
+                item.image.storage.delete(rendition['name'])
 
 
     def test_img_url(self):
         item_valid_image = Item.objects.get(name="valid_img")
-        self.assertEqual(item_valid_image.image_url, '/media/download.jpg')
+        self.assertEqual(item_valid_image.image_url, '/media/' + content_name('auctions/download.jpg'))
 
     def test_no_img_url(self):
         item_no_image = Item.objects.get(name="no_img")
         self.assertEqual('', item_no_image.image_url)
 
+    def test_has_image_recorded(self):
+        """ Image presence is recorded when the item is saved """
+        self.assertTrue(Item.objects.get(name="valid_img").has_image)
+        self.assertFalse(Item.objects.get(name="no_img").has_image)
+
+    def test_img_url_no_file_system_access(self):
+        """ image_url relies on the recorded flag instead of checking the file """
+        item_valid_image = Item.objects.get(name="valid_img")
+        os.remove(item_valid_image.image.path)
+
+        self.assertEqual(item_valid_image.image_url, '/media/' + content_name('auctions/download.jpg'))
+
+    def test_save_without_image_change(self):
+        """ Saving an item that keeps its image runs no extra query and deletes nothing """
+        # the category name expires its cached pages
+        item = Item.objects.select_related('category').get(name="valid_img")
+        item.name = "renamed"
+
+        with self.captureOnCommitCallbacks() as callbacks, self.assertNumQueries(1):
+            item.save()
+
+        # only the expiry of its cached pages, no image job
+        self.assertEqual(len(callbacks), 1)
+        self.assertTrue(os.path.exists(item.image.path))
+
+    def test_replace_image(self):
+        """ The old image is released on edit, and deleted by gc_blobs """
+        item = Item.objects.get(name="valid_img")
+        old_name = item.image.name
+        old_path = item.image.path
+        item.image = File(open('auctions/images.jpg', 'rb'), name='images.jpg')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            item.save()
+
+        self.assertEqual(StoredBlob.objects.get(name=old_name).refs, 0)
+        self.assertEqual(StoredBlob.objects.get(name=item.image.name).refs, 1)
+        self.assertTrue(os.path.exists(old_path))
+
+        call_command('gc_blobs', '--grace', '0', stdout=StringIO())
+        self.assertFalse(os.path.exists(old_path))
+        self.assertTrue(os.path.exists(item.image.path))
+
+    def test_rolled_back_image_edit(self):
+        """ A rolled back edit doesn't delete the image that is still in use """
+        item = Item.objects.get(name="valid_img")
+        old_path = item.image.path
+        item.image = File(open('auctions/images.jpg', 'rb'), name='images.jpg')
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    item.save()
+                    raise IntegrityError
+            except IntegrityError:
+                pass
+
+        os.remove(item.image.path)
+        self.assertEqual(callbacks, [])
+        self.assertTrue(os.path.exists(old_path))
+        self.assertEqual(StoredBlob.objects.get(name=content_name('auctions/download.jpg')).refs, 1)
+
     def test_increase_popularity(self):
         """ Test the increase popularity method """
         item = Item.objects.get(name='no_img')
@@ -65,6 +146,78 @@ class ItemTestCase(TestCase):
 
         self.assertEqual(item.popularity, 4)
 
+    def test_popularity_limits(self):
+        """ Popularity doesn't go under 0 or over POPULARITY_MAX """
+        item = Item.objects.get(name='no_img')
+
+        item.decrease_popularity()
+        item.refresh_from_db()
+        self.assertEqual(item.popularity, 0)
+
+        Item.objects.filter(pk=item.pk).update(popularity=POPULARITY_MAX)
+        item.refresh_from_db()
+        item.increase_popularity()
+        item.refresh_from_db()
+        self.assertEqual(item.popularity, POPULARITY_MAX)
+
+    def test_popularity_stale_instances(self):
+        """ Changes made through stale instances aren't lost, and cost a single query """
+        first = Item.objects.get(name='no_img')
+        second = Item.objects.get(name='no_img')
+
+        with self.assertNumQueries(1):
+            first.increase_popularity()
+        second.increase_popularity()
+        second.increase_popularity()
+        first.decrease_popularity()
+        first.refresh_from_db()
+
+        self.assertEqual(first.popularity, 2)
+
+    def test_watchers_counted_once(self):
+        """ Adding or removing a watcher twice only changes popularity once """
+        item = Item.objects.get(name='no_img')
+        watcher = User.objects.create_user(username="watcher", password="asdf")
+
+        self.assertTrue(item.add_watcher(watcher))
+        self.assertFalse(item.add_watcher(watcher))
+        item.watchlist.add(watcher)
+        item.refresh_from_db()
+        self.assertEqual(item.popularity, 1)
+        self.assertTrue(item.is_watched_by(watcher))
+
+        self.assertTrue(item.remove_watcher(watcher))
+        self.assertFalse(item.remove_watcher(watcher))
+        item.refresh_from_db()
+        self.assertEqual(item.popularity, 0)
+        self.assertFalse(item.is_watched_by(watcher))
+
+    def test_remove_non_watcher(self):
+        """ Removing someone who isn't watching the item leaves its popularity alone """
+        item = Item.objects.get(name='no_img')
+        watcher = User.objects.create_user(username="watcher", password="asdf")
+        other = User.objects.create_user(username="other", password="asdf")
+        item.watchlist.add(watcher)
+
+        item.watchlist.remove(other)
+        item.refresh_from_db()
+        self.assertEqual(item.popularity, 1)
+
+        item.watchlist.remove(watcher)
+        item.refresh_from_db()
+        self.assertEqual(item.popularity, 0)
+
+    def test_toggle_watcher(self):
+        """ Toggling alternates between watching and not watching """
+        item = Item.objects.get(name='no_img')
+        watcher = User.objects.create_user(username="watcher", password="asdf")
+
+        self.assertTrue(item.toggle_watcher(watcher))
+        self.assertFalse(item.toggle_watcher(watcher))
+        self.assertTrue(item.toggle_watcher(watcher))
+        item.refresh_from_db()
+        self.assertEqual(item.popularity, 1)
+
     def test_elapsed_time(self):
         """ Time is formated correctly """
         item = Item.objects.first()
@@ -76,4 +229,131 @@ class ItemTestCase(TestCase):
         self.assertEqual(item.elapsed_time(433000), '5 days ago')
         self.assertEqual(item.elapsed_time(2100000), '24 days ago')
         self.assertEqual(item.elapsed_time(27000000), '10 months ago')
-        self.assertEqual(item.elapsed_time(32000000), '1 year ago')
\ No newline at end of file
+        self.assertEqual(item.elapsed_time(32000000), '1 year ago')
+
+
+class BidTotalsTestCase(TestCase):
+
+    def setUp(self):
+        self.seller = User.objects.create_user(username="seller", password="asdf")
+        self.buyer = User.objects.create_user(username="buyer", password="asdf")
+        other = Category.objects.create(category="Other")
+        self.item = Item.objects.create(user=self.seller, name="item", starting_price=20, category=other)
+
+    def test_no_bids(self):
+        """ Items without bids are priced at their starting price """
+        self.assertIsNone(self.item.current_price)
+        self.assertEqual(self.item.price, 20)
+        self.assertEqual(self.item.bid_count, 0)
+        self.assertIsNone(self.item.top_bid)
+
+    def test_place_bid(self):
+        """ Accepted bids update the price columns of the item """
+        self.assertIsNone(self.item.place_bid(self.buyer, 20))
+        first = self.item.place_bid(self.buyer, 25.5)
+        second = self.item.place_bid(self.buyer, 30)
+        self.assertIsNone(self.item.place_bid(self.buyer, 30))
+
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.current_price, Decimal('30'))
+        self.assertEqual(self.item.bid_count, 2)
+        self.assertEqual(self.item.top_bid, second)
+        self.assertEqual(first.bid, Decimal('25.5'))
+
+    def test_lower_bid_created_directly(self):
+        """ Bids lower than the current price are counted but don't change the price """
+        top = Bid.objects.create(bid=50, item=self.item, user=self.buyer)
+        Bid.objects.create(bid=40, item=self.item, user=self.buyer)
+
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.current_price, 50)
+        self.assertEqual(self.item.bid_count, 2)
+        self.assertEqual(self.item.top_bid, top)
+
+    def test_equal_bid_created_directly(self):
+        """ A bid equal to the current price doesn't take over the top bid, the earliest one keeps it
+        like rebuild_bid_totals would decide """
+        top = self.item.place_bid(self.buyer, 50)
+        Bid.objects.create(bid=50, item=self.item, user=self.seller)
+        Bid.objects.create(bid=50, item=Item.objects.get(pk=self.item.pk), user=self.seller)
+
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.top_bid, top)
+        self.assertEqual(self.item.bid_count, 3)
+
+        Item.objects.rebuild_bid_totals()
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.top_bid, top)
+
+    def test_rebuild_bid_totals(self):
+        """ The management command recomputes the columns from the bids """
+        self.item.place_bid(self.buyer, 30)
+        top = self.item.place_bid(self.buyer, 40)
+        Item.objects.update(current_price=None, bid_count=0, top_bid=None)
+
+        call_command('rebuild_bid_totals', stdout=StringIO())
+
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.current_price, 40)
+        self.assertEqual(self.item.bid_count, 2)
+        self.assertEqual(self.item.top_bid, top)
+
+
+class ConcurrentBidTestCase(TransactionTestCase):
+
+    THREADS = 8
+    BIDS_PER_THREAD = 250
+
+    def setUp(self):
+        seller = User.objects.create_user(username="seller", password="asdf")
+        self.buyers = [User.objects.create_user(username=f"buyer{i}", password="asdf") for i in range(self.THREADS)]
+        other = Category.objects.create(category="Other")
+        self.item = Item.objects.create(user=seller, name="item", starting_price=1, category=other)
+        self.barrier = threading.Barrier(self.THREADS)
+
+    def retry(self, function):
+        """ The in-memory test database reports 'table is locked' instead
+        of waiting for other writers, so keep retrying """
+        while True:
+            try:
+                return function()
+            except OperationalError:
+                time.sleep(random.uniform(0, 0.002))
+
+    def bidder(self, buyer, amounts):
+        """ Like the bid view: loads the item, then bids on it, at the same time as the other bidders """
+        accepted = []
+        try:
+            for amount in amounts:
+                item = self.retry(lambda: Item.objects.get(pk=self.item.pk))
+                self.barrier.wait()
+                if self.retry(lambda: item.place_bid(buyer, amount)) is not None:
+                    accepted.append(amount)
+        finally:
+            connection.close()
+        return accepted
+
+    def test_concurrent_bids(self):
+        """ Thousands of simultaneous bids leave the item priced at the highest one """
+        # Each round of bids outbids the previous round, so every bidder of a round
+        # sees a price it can beat and only the order of the inserts decides the winners
+        amounts = [
+            [Decimal(10 * round + random.randint(1, 9)) for round in range(1, self.BIDS_PER_THREAD + 1)]
+            for _ in range(self.THREADS)
+        ]
+        with ThreadPoolExecutor(max_workers=self.THREADS) as pool:
+            accepted = sum(pool.map(self.bidder, self.buyers, amounts), [])
+
+        bids = list(Bid.objects.filter(item=self.item).order_by('id'))
+        self.item.refresh_from_db()
+
+        # Every accepted bid was higher than all the bids accepted before it
+        self.assertEqual(len(bids), len(accepted))
+        for previous, bid in zip(bids, bids[1:]):
+            self.assertLess(previous.bid, bid.bid)
+
+        highest = max(sum(amounts, []))
+        self.assertEqual(self.item.current_price, highest)
+        self.assertEqual(self.item.bid_count, len(bids))
+        self.assertEqual(self.item.top_bid, bids[-1])
+        self.assertEqual(self.item.top_bid.bid, highest)
@@ -0,0 +1,112 @@
+from django.test import TestCase, Client
+from django.urls import reverse
+from django.utils import timezone
+from datetime import timedelta
+from auctions.models import Category, User, Item
+from auctions.pagination import paginate, encode_cursor, MAX_PAGE_SIZE, NEXT
+
+
+class PaginateTestCase(TestCase):
+
+    def setUp(self):
+        testuser = User.objects.create_user(username='testuser', password='testuser')
+        other = Category.objects.create(category='Other')
+
+        # item0 is the oldest, item9 the most recent
+        now = timezone.now()
+        for i in range(10):
+            item = Item.objects.create(name=f'item{i}', starting_price=5, user=testuser, category=other)
+            Item.objects.filter(pk=item.pk).update(updated_at=now - timedelta(minutes=10 - i), popularity=i % 3)
+
+    def names(self, page):
+        return [item.name for item in page]
+
+    def test_first_page(self):
+        """ The first page has no previous page and links to the next one """
+        page = paginate(Item.objects.all(), ('updated_at', 'id'), page_size=4)
+
+        self.assertEqual(self.names(page), ['item9', 'item8', 'item7', 'item6'])
+        self.assertTrue(page.has_next)
+        self.assertFalse(page.has_previous)
+
+    def test_walk_all_pages(self):
+        """ Following the next cursors visits every item once, in order """
+        items = Item.objects.all()
+        page = paginate(items, ('updated_at', 'id'), page_size=4)
+        names = self.names(page)
+
+        while page.has_next:
+            page = paginate(items, ('updated_at', 'id'), page.next_cursor, page_size=4)
+            names += self.names(page)
+
+        self.assertEqual(names, [f'item{i}' for i in range(9, -1, -1)])
+        self.assertFalse(page.has_next)
+        self.assertTrue(page.has_previous)
+
+    def test_previous_page(self):
+        """ The previous cursor of the second page leads back to the first page """
+        items = Item.objects.all()
+        first = paginate(items, ('updated_at', 'id'), page_size=4)
+        second = paginate(items, ('updated_at', 'id'), first.next_cursor, page_size=4)
+        previous = paginate(items, ('updated_at', 'id'), second.previous_cursor, page_size=4)
+
+        self.assertEqual(self.names(previous), self.names(first))
+        self.assertFalse(previous.has_previous)
+        self.assertEqual(previous.next_cursor, first.next_cursor)
+
+    def test_pages_stable_on_reorder(self):
+        """ An item moving to the top doesn't make the next page repeat items """
+        items = Item.objects.all()
+        first = paginate(items, ('updated_at', 'id'), page_size=4)
+
+        # item2 gets a new bid and becomes the most recent item
+        Item.objects.filter(name='item2').update(updated_at=timezone.now())
+        second = paginate(items, ('updated_at', 'id'), first.next_cursor, page_size=4)
+
+        self.assertEqual(self.names(second), ['item5', 'item4', 'item3', 'item1'])
+
+    def test_ties_broken_by_id(self):
+        """ Items with the same popularity are ordered by id and never skipped """
+        items = Item.objects.all()
+        page = paginate(items, ('popularity', 'id'), page_size=3)
+        names = self.names(page)
+
+        while page.has_next:
+            page = paginate(items, ('popularity', 'id'), page.next_cursor, page_size=3)
+            names += self.names(page)
+
+        expected = [item.name for item in Item.objects.order_by('-popularity', '-id')]
+        self.assertEqual(names, expected)
+
+    def test_decimal_keys(self):
+        """ Prices are kept exactly in the cursors """
+        Item.objects.filter(name__in=['item3', 'item4']).update(starting_price='10.10')
+        items = Item.objects.all()
+        first = paginate(items, ('starting_price', 'id'), page_size=1)
+        second = paginate(items, ('starting_price', 'id'), first.next_cursor, page_size=1)
+
+        self.assertEqual(self.names(first) + self.names(second), ['item4', 'item3'])
+
+    def test_invalid_cursor(self):
+        """ Cursors that can't be decoded fall back to the first page """
+        items = Item.objects.all()
+        first = paginate(items, ('updated_at', 'id'), page_size=4)
+
+        for cursor in ['garbage', encode_cursor(NEXT, ['not a date', 1]), encode_cursor('x', []),
+                       encode_cursor(NEXT, [first.object_list[0].updated_at, 10 ** 30])]:
+            page = paginate(items, ('updated_at', 'id'), cursor, page_size=4)
+            self.assertEqual(self.names(page), self.names(first))
+
+        # numbers too large for the database column
+        response = Client().get(reverse('populars'), {'cursor': encode_cursor(NEXT, [1, 10 ** 30])})
+        self.assertEqual(response.status_code, 200)
+
+    def test_page_size_capped(self):
+        """ The page size asked on the url can't go over MAX_PAGE_SIZE """
+        client = Client()
+        response = client.get(reverse('index'), {'size': 1000})
+        self.assertEqual(response.context['page'].page_size, MAX_PAGE_SIZE)
+
+        response = client.get(reverse('index'), {'size': 3})
+        self.assertEqual(len(response.context['items']), 3)
+        self.assertTrue(response.context['page'].has_next)
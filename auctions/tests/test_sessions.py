@@ -0,0 +1,69 @@
+from django.test import TestCase, Client
+from django.conf import settings
+from django.contrib.sessions.backends.cached_db import KEY_PREFIX
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from auctions.models import User
+from datetime import timedelta
+from io import StringIO
+
+
+class SessionTestCase(TestCase):
+
+    def setUp(self):
+        User.objects.create_user(username='buyer', password='buyer')
+        self.sessions = caches[settings.SESSION_CACHE_ALIAS]
+
+    def login(self):
+        client = Client()
+        client.login(username='buyer', password='buyer')
+        return client
+
+    def test_sessions_read_from_cache(self):
+        """ Logged in requests find their session in the cache, the database isn't read """
+        client = self.login()
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(reverse('watchlist'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any('django_session' in query['sql'] for query in context.captured_queries))
+
+    def test_sessions_written_through(self):
+        """ Sessions are also in the database, they survive losing the cache """
+        client = self.login()
+        self.sessions.clear()
+
+        response = client.get(reverse('watchlist'))
+        self.assertContains(response, 'Welcome <strong>buyer</strong>')
+
+    def test_anonymous_without_session(self):
+        """ Visiting the site doesn't store sessions """
+        Client().get(reverse('index'))
+        self.assertFalse(Session.objects.exists())
+
+    def test_expire_sessions(self):
+        """ Expired sessions are deleted in batches, current ones are kept """
+        clients = [self.login() for i in range(5)]
+        expired = [client.session.session_key for client in clients[:3]]
+        Session.objects.filter(session_key__in=expired).update(expire_date=timezone.now() - timedelta(seconds=1))
+
+        out = StringIO()
+        call_command('expire_sessions', '--batch-size', '2', stdout=out)
+
+        self.assertIn("Deleted 3", out.getvalue())
+        self.assertEqual(Session.objects.count(), 2)
+        self.assertIsNone(self.sessions.get(KEY_PREFIX + expired[0]))
+        self.assertContains(clients[4].get(reverse('watchlist')), 'Welcome <strong>buyer</strong>')
+
+    def test_expire_all_sessions(self):
+        """ --all logs everybody out, cached copies included """
+        client = self.login()
+        call_command('expire_sessions', '--all', stdout=StringIO())
+
+        self.assertFalse(Session.objects.exists())
+        self.assertRedirects(client.get(reverse('watchlist')), reverse('login'))
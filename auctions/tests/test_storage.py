@@ -0,0 +1,145 @@
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.urls import reverse
+from django.utils import timezone
+from auctions.models import Category, User, Item, StoredBlob
+from datetime import timedelta
+from io import StringIO
+import hashlib
+import os
+import threading
+import time
+from unittest import mock
+
+
+@override_settings(IMAGE_JOB_WORKERS=0)
+class ContentAddressedStorageTestCase(TestCase):
+
+    def setUp(self):
+        self.testuser = User.objects.create_user(username="testuser", password="asdf")
+        self.other = Category.objects.create(category="Other")
+
+    def tearDown(self):
+        for blob in StoredBlob.objects.all():
+            default_storage.delete(blob.name)
+
+    def create_item(self, name, path='auctions/download.jpg'):
+        item = Item(user=self.testuser, name=name, starting_price=50, category=self.other)
+        with self.captureOnCommitCallbacks(execute=True):
+            item.image.save(os.path.basename(path), File(open(path, 'rb')))
+        return item
+
+    def test_named_by_content(self):
+        """ Files are stored under the sha256 of their content, sharded in folders """
+        digest = hashlib.sha256(b'content').hexdigest()
+        name = default_storage.save('notes.TXT', ContentFile(b'content'))
+
+        self.assertEqual(name, f'{digest[:2]}/{digest[2:4]}/{digest}.txt')
+        with default_storage.open(name) as file:
+            self.assertEqual(file.read(), b'content')
+        self.assertEqual(StoredBlob.objects.get(name=name).refs, 0)
+
+    def test_same_content_stored_once(self):
+        """ Items uploading the same image share one file with a reference each """
+        first = self.create_item('first')
+        second = self.create_item('second')
+
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(len(os.listdir(os.path.dirname(first.image.path))), 1)
+        self.assertEqual(StoredBlob.objects.get(name=first.image.name).refs, 2)
+
+    def test_shared_file_kept_until_unreferenced(self):
+        """ Deleting an item only deletes its image once no other item uses it """
+        first = self.create_item('first')
+        second = self.create_item('second')
+        path = first.image.path
+
+        first.delete()
+        call_command('gc_blobs', '--grace', '0', stdout=StringIO())
+        self.assertTrue(os.path.exists(path))
+
+        second.delete()
+        call_command('gc_blobs', '--grace', '0', stdout=StringIO())
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(StoredBlob.objects.exists())
+
+    def test_gc_grace_period(self):
+        """ Recently stored files are spared, they may be about to be referenced """
+        name = default_storage.save('notes.txt', ContentFile(b'content'))
+
+        call_command('gc_blobs', stdout=StringIO())
+        self.assertTrue(default_storage.exists(name))
+
+        StoredBlob.objects.update(updated_at=timezone.now() - timedelta(hours=2))
+        call_command('gc_blobs', stdout=StringIO())
+        self.assertFalse(default_storage.exists(name))
+
+    def test_gc_batches(self):
+        """ Every unreferenced file is collected whatever the batch size, referenced ones are kept """
+        names = [default_storage.save('notes.txt', ContentFile(str(number).encode())) for number in range(5)]
+        StoredBlob.objects.acquire(names[:1])
+
+        out = StringIO()
+        call_command('gc_blobs', '--grace', '0', '--batch-size', '2', stdout=out)
+
+        self.assertIn("Deleted 4", out.getvalue())
+        self.assertEqual([default_storage.exists(name) for name in names], [True, False, False, False, False])
+
+    def test_media_cached_for_good(self):
+        """ Content-addressed files are served with long-lived, immutable cache headers """
+        item = self.create_item('first')
+        response = self.client.get(item.image_url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        response.close()
+
+        response = self.client.get(reverse('media', args=['missing.jpg']))
+        self.assertEqual(response.status_code, 404)
+
+
+class GarbageCollectionRaceTestCase(TransactionTestCase):
+
+    def tearDown(self):
+        for blob in StoredBlob.objects.all():
+            default_storage.delete(blob.name)
+
+    def upload(self, results):
+        """ Stores the content again, from another connection """
+        try:
+            while True:
+                try:
+                    results.append(default_storage.save('notes.txt', ContentFile(b'content')))
+                    return
+                # the in-memory test database reports 'table is locked' instead of waiting for gc_blobs
+                except OperationalError:
+                    time.sleep(0.005)
+        finally:
+            connection.close()
+
+    def test_upload_while_collected(self):
+        """ Uploading a file while gc_blobs deletes it leaves the file stored """
+        name = default_storage.save('notes.txt', ContentFile(b'content'))
+        StoredBlob.objects.update(updated_at=timezone.now() - timedelta(hours=2))
+
+        results = []
+        uploader = threading.Thread(target=self.upload, args=(results,))
+        delete = default_storage.delete
+
+        def delete_during_upload(name):
+            # the row is already deleted, the upload runs before the file is
+            uploader.start()
+            uploader.join(0.2)
+            delete(name)
+
+        with mock.patch.object(default_storage, 'delete', delete_during_upload):
+            call_command('gc_blobs', stdout=StringIO())
+        uploader.join()
+
+        self.assertEqual(results, [name])
+        self.assertTrue(default_storage.exists(name))
+        self.assertTrue(StoredBlob.objects.filter(name=name).exists())
@@ -0,0 +1,71 @@
+from django.test import SimpleTestCase, TestCase
+from django.template import Context, Template
+from django.utils import timezone
+from auctions.models import Category, User, Item, Bid, Comment
+from auctions.timesince import elapsed_since, format_elapsed
+from datetime import timedelta
+from unittest import mock
+
+
+class FormatElapsedTestCase(SimpleTestCase):
+
+    def test_boundaries(self):
+        """ Every age falls in exactly one unit, the bounds belong to the larger one """
+        self.assertEqual(format_elapsed(0), '0 minutes ago')
+        self.assertEqual(format_elapsed(59), '0 minutes ago')
+        self.assertEqual(format_elapsed(60), '1 minute ago')
+        self.assertEqual(format_elapsed(3599), '59 minutes ago')
+        self.assertEqual(format_elapsed(3600), '1 hour ago')
+        self.assertEqual(format_elapsed(86399), '23 hours ago')
+        self.assertEqual(format_elapsed(86400), '1 day ago')
+        self.assertEqual(format_elapsed(2627999), '30 days ago')
+        self.assertEqual(format_elapsed(2628000), '1 month ago')
+        self.assertEqual(format_elapsed(31535999), '11 months ago')
+        self.assertEqual(format_elapsed(31536000), '1 year ago')
+        self.assertEqual(format_elapsed(63072000), '2 years ago')
+
+    def test_negative_age(self):
+        """ Dates slightly in the future (clock drift) show as just posted """
+        self.assertEqual(format_elapsed(-5), '0 minutes ago')
+
+    def test_elapsed_since_single_now(self):
+        """ A whole list is formatted against the same now, datetimes and timestamps alike """
+        now = timezone.now()
+        moments = [now - timedelta(minutes=5), (now - timedelta(hours=2)).timestamp(), now - timedelta(days=400)]
+
+        self.assertEqual(
+            elapsed_since(moments, now.timestamp()),
+            ['5 minutes ago', '2 hours ago', '1 year ago']
+        )
+
+    def test_elapsed_tag_single_now(self):
+        """ The template tag reads the clock once per render """
+        now = timezone.now()
+        template = Template('{% load elapsed %}{% for moment in moments %}{% elapsed moment %};{% endfor %}')
+        moments = [now - timedelta(seconds=3600), now - timedelta(days=1)]
+
+        with mock.patch('auctions.templatetags.elapsed.time.time', return_value=now.timestamp()) as clock:
+            rendered = template.render(Context({'moments': moments}))
+
+        self.assertEqual(rendered, '1 hour ago;1 day ago;')
+        self.assertEqual(clock.call_count, 1)
+
+
+class RowTimesTestCase(TestCase):
+
+    def setUp(self):
+        seller = User.objects.create_user(username='seller', password='seller')
+        buyer = User.objects.create_user(username='buyer', password='buyer')
+        other = Category.objects.create(category='Other')
+        item = Item.objects.create(name='item', starting_price=10, user=seller, category=other)
+        item.place_bid(buyer, 20)
+        Comment.objects.create(comment='nice', user=buyer, item=item)
+
+    def test_row_times_without_item(self):
+        """ Bid and comment times don't load their item """
+        bid = Bid.objects.get()
+        comment = Comment.objects.get()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(bid.bid_time(), '0 minutes ago')
+            self.assertEqual(comment.comment_time(), '0 minutes ago')
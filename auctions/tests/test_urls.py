@@ -37,6 +37,14 @@ class TestUrls(SimpleTestCase):
         url = reverse('item', args=(4,))
         self.assertEqual(resolve(url).func, item)
 
+    def test_item_bids_url_resolves(self):
+        url = reverse('item_bids', args=(4,))
+        self.assertEqual(resolve(url).func, item_bids)
+
+    def test_item_comments_url_resolves(self):
+        url = reverse('item_comments', args=(4,))
+        self.assertEqual(resolve(url).func, item_comments)
+
     def test_watch_url_resolves(self):
         url = reverse('watch', args=(6,))
         self.assertEqual(resolve(url).func, watch)
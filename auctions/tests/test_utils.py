@@ -1,7 +1,20 @@
 from django.test import SimpleTestCase
 from django.core.files import File
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.urls import reverse
 from auctions.utils import image_is_valid, name_is_valid, price_is_valid
+import struct
+import zlib
+
+
+def png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def png_header(width, height):
+    """ PNG file of an image of the given size, without any pixel data """
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + png_chunk(b'IHDR', ihdr) + png_chunk(b'IDAT', b'') + png_chunk(b'IEND', b'')
 
 
 class TestUtils(SimpleTestCase):
@@ -18,6 +31,32 @@ class TestUtils(SimpleTestCase):
         self.assertFalse(image_is_valid(invalid_image_format))
         self.assertFalse(image_is_valid(invalid_image_size))
 
+    def test_image_validated_by_content(self):
+        """ The file name doesn't matter, only the content """
+        with open('auctions/download.jpg', 'rb') as file:
+            jpeg = file.read()
+        with open('auctions/gas_prices.csv', 'rb') as file:
+            csv = file.read()
+
+        self.assertTrue(image_is_valid(SimpleUploadedFile('photo.PNG', jpeg)))
+        self.assertTrue(image_is_valid(SimpleUploadedFile('photo', jpeg)))
+        self.assertFalse(image_is_valid(SimpleUploadedFile('prices.jpg', csv)))
+        self.assertFalse(image_is_valid(SimpleUploadedFile('truncated.jpg', jpeg[:20])))
+        self.assertFalse(image_is_valid(SimpleUploadedFile('empty.jpg', b'')))
+
+    def test_image_pixel_limit(self):
+        """ Small files claiming huge dimensions are rejected from their header """
+        self.assertTrue(image_is_valid(SimpleUploadedFile('small.png', png_header(4000, 4000))))
+        self.assertFalse(image_is_valid(SimpleUploadedFile('wide.png', png_header(6000, 6000))))
+        self.assertFalse(image_is_valid(SimpleUploadedFile('bomb.png', png_header(100000, 100000))))
+
+    def test_image_rewound(self):
+        """ The file is left at its start to be saved afterwards """
+        image = File(open('auctions/download.jpg', 'rb'))
+        self.assertTrue(image_is_valid(image))
+        self.assertEqual(image.tell(), 0)
+        image.close()
+
     def test_name_is_valid(self):
         self.assertTrue(name_is_valid('Jose Wilhelm'))
         self.assertTrue(name_is_valid('joselws'))
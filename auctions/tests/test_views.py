@@ -1,9 +1,17 @@
 from django.test import TestCase, Client
+from django.contrib.auth.models import AnonymousUser
 from django.db import IntegrityError
 from auctions.models import Category, User, Item, Bid, Comment
 from django.db.models import Max
 from django.core.files import File
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.urls import reverse
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from auctions.uploads import TOO_LARGE
+from auctions.pagination import HISTORY_SIZE
+import hashlib
 import os
 
 
@@ -12,6 +20,8 @@ import os
 class IndexTestCase(TestCase):
 
     def setUp(self):
+        # pages are only expired on commit, which never comes in a TestCase
+        cache.clear()
         # Create user
         testuser = User.objects.create_user(username="testuser", password="asdf")
 
@@ -42,7 +52,7 @@ class IndexTestCase(TestCase):
         response = client.get(reverse('index'))
 
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.context['items'].count(), 3)
+        self.assertEqual(len(response.context['items']), 3)
         self.assertEqual(response.request.get('PATH_INFO'), '/')
         self.assertEqual(response.context['page_title'], 'Recent Items')
         self.assertEqual(response.context['empty'], 'There are no active items in the auction!')
@@ -100,7 +110,8 @@ class LoginTestCase(TestCase):
 class LogoutTestCase(TestCase):
 
     def setUp(self):
-
+        # pages are only expired on commit, which never comes in a TestCase
+        cache.clear()
         User.objects.create_user(username="testuser1", password="testuser1")
         
     
@@ -317,6 +328,36 @@ class CreateTestCase(TestCase):
         self.assertEqual(item.name, 'Test Item')
         self.assertTemplateUsed(response, 'auctions/item.html')
 
+    def test_create_image_named_by_content(self):
+        """ Uploaded images are stored under the sha256 of their content """
+        client = Client()
+        client.login(username='testuser', password='testuser')
+        with open('auctions/download.jpg', 'rb') as file:
+            digest = hashlib.sha256(file.read()).hexdigest()
+
+        for name in ('Test Item', 'Same Image'):
+            data = {'name': name, 'description': '', 'price': 50, 'category': 'House',
+                'image': File(open('auctions/download.jpg', 'rb'))}
+            client.post(reverse('create'), data)
+
+        first, second = Item.objects.order_by('id')
+        self.assertEqual(first.image.name, f'{digest[:2]}/{digest[2:4]}/{digest}.jpg')
+        self.assertEqual(second.image.name, first.image.name)
+        self.assertTrue(os.path.exists(first.image.path))
+
+    def test_create_image_too_large(self):
+        """ Uploads are stopped once they go over 2MB """
+        client = Client()
+        client.login(username='testuser', password='testuser')
+        data = {'name': 'Test Item', 'description': '', 'price': 50, 'category': 'House',
+            'image': SimpleUploadedFile('large.jpg', b'\xff\xd8\xff' + bytes(2200000))}
+        response = client.post(reverse('create'), data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['message'], TOO_LARGE)
+        self.assertEqual(Item.objects.count(), 0)
+        self.assertTemplateUsed(response, 'auctions/create.html')
+
     def test_nonauthenticated_create_valid_post_all_data_request(self):
         house = Category.objects.get(category="House")
         testuser = User.objects.get(username="testuser")
@@ -804,6 +845,37 @@ class WatchViewTestCase(TestCase):
         self.assertQuerysetEqual(item.watchlist.all(), [])
         self.assertTemplateUsed(response, 'auctions/item.html')
 
+    def test_explicit_watch_action_idempotent(self):
+        """ Retried add or remove requests leave the watchlist and popularity as the first one did """
+        client = Client()
+        client.login(username="testuser1", password="testuser1")
+        item = Item.objects.get(name='item')
+
+        for i in range(2):
+            client.post(reverse('watch', args=(item.id,)), {'action': 'add'})
+        item.refresh_from_db()
+        self.assertQuerysetEqual(item.watchlist.all(), list(User.objects.filter(username='testuser1')))
+        self.assertEqual(item.popularity, 1)
+
+        for i in range(2):
+            client.post(reverse('watch', args=(item.id,)), {'action': 'remove'})
+        item.refresh_from_db()
+        self.assertQuerysetEqual(item.watchlist.all(), [])
+        self.assertEqual(item.popularity, 0)
+
+    def test_watch_toggles(self):
+        """ Without an action every POST switches the watchlist """
+        client = Client()
+        client.login(username="testuser1", password="testuser1")
+        item = Item.objects.get(name='item')
+
+        client.post(reverse('watch', args=(item.id,)))
+        self.assertTrue(item.is_watched_by(User.objects.get(username='testuser1')))
+        client.post(reverse('watch', args=(item.id,)))
+        self.assertFalse(item.is_watched_by(User.objects.get(username='testuser1')))
+        item.refresh_from_db()
+        self.assertEqual(item.popularity, 0)
+
 
 ##### Bid view #####
 
@@ -1227,7 +1299,7 @@ class CategoryPageViewTestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.request['PATH_INFO'], f'/category/{category_name}')
         self.assertQuerysetEqual(response.context['items'], list(items))
-        self.assertEqual(response.context['items'].count(), 3)
+        self.assertEqual(len(response.context['items']), 3)
         self.assertEqual(response.context['page_title'], category_name)
         self.assertEqual(response.context['empty'], 'There are no active items for this category!')
         self.assertTemplateUsed(response, 'auctions/items.html')
@@ -1243,7 +1315,7 @@ class CategoryPageViewTestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.request['PATH_INFO'], f'/category/{category_name}')
         self.assertQuerysetEqual(response.context['items'], list(items))
-        self.assertEqual(response.context['items'].count(), 3)
+        self.assertEqual(len(response.context['items']), 3)
         self.assertEqual(response.context['page_title'], category_name)
         self.assertEqual(response.context['empty'], 'There are no active items for this category!')
         self.assertTemplateUsed(response, 'auctions/items.html')
@@ -1260,7 +1332,7 @@ class CategoryPageViewTestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.request['PATH_INFO'], f'/category/{category_name}')
         self.assertQuerysetEqual(response.context['items'], list(items))
-        self.assertEqual(response.context['items'].count(), 3)
+        self.assertEqual(len(response.context['items']), 3)
         self.assertEqual(response.context['page_title'], category_name)
         self.assertEqual(response.context['empty'], 'There are no active items for this category!')
         self.assertTemplateUsed(response, 'auctions/items.html')
@@ -1285,7 +1357,7 @@ class CategoryPageViewTestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.request['PATH_INFO'], f'/category/{category_name}')
         self.assertQuerysetEqual(response.context['items'], list(items))
-        self.assertEqual(response.context['items'].count(), 1)
+        self.assertEqual(len(response.context['items']), 1)
         self.assertEqual(response.context['page_title'], category_name)
         self.assertEqual(response.context['empty'], 'There are no active items for this category!')
         self.assertTemplateUsed(response, 'auctions/items.html')
@@ -1301,7 +1373,7 @@ class CategoryPageViewTestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.request['PATH_INFO'], f'/category/{category_name}')
         self.assertQuerysetEqual(response.context['items'], list(items))
-        self.assertEqual(response.context['items'].count(), 0)
+        self.assertEqual(len(response.context['items']), 0)
         self.assertEqual(response.context['page_title'], category_name)
         self.assertEqual(response.context['empty'], 'There are no active items for this category!')
         self.assertTemplateUsed(response, 'auctions/items.html')
@@ -1439,6 +1511,21 @@ class EditViewTestCase(TestCase):
         self.assertQuerysetEqual(response.context['categories'], list(Category.objects.all()))
         self.assertTemplateUsed(response, 'auctions/edit.html')
 
+    def test_authorized_edit_image_too_large(self):
+        """ Uploads over 2MB are stopped and the item is left untouched """
+        client = Client()
+        client.login(username='testuser', password='testuser')
+        item = Item.objects.get(name="item")
+        image = SimpleUploadedFile('large.png', b'\x89PNG\r\n\x1a\n' + bytes(2200000))
+        data = {'name': 'item edited', 'description': '', 'image': image}
+        response = client.post(reverse('edit', args=(item.id,)), data)
+        item.refresh_from_db()
+
+        self.assertEqual(response.context['message'], TOO_LARGE)
+        self.assertEqual(item.name, 'item')
+        self.assertFalse(item.has_image)
+        self.assertTemplateUsed(response, 'auctions/edit.html')
+
     
 class DeleteViewTestCase(TestCase):
 
@@ -1616,7 +1703,7 @@ class MyItemsTestCase(TestCase):
         self.assertEqual(response.request['PATH_INFO'], '/my_items')
         self.assertEqual(response.context['page_title'], page_title)
         self.assertEqual(response.context['empty'], empty)
-        self.assertEqual(response.context['items'].count(), 2)
+        self.assertEqual(len(response.context['items']), 2)
         self.assertQuerysetEqual(response.context['items'], list(items), ordered=False)
         self.assertTemplateUsed(response, 'auctions/items.html')
 
@@ -1634,7 +1721,7 @@ class MyItemsTestCase(TestCase):
         self.assertEqual(response.request['PATH_INFO'], '/my_items')
         self.assertEqual(response.context['page_title'], page_title)
         self.assertEqual(response.context['empty'], empty)
-        self.assertEqual(response.context['items'].count(), 2)
+        self.assertEqual(len(response.context['items']), 2)
         self.assertQuerysetEqual(response.context['items'], list(items), ordered=False)
         self.assertTemplateUsed(response, 'auctions/items.html')
 
@@ -1675,6 +1762,242 @@ class MyItemsTestCase(TestCase):
         self.assertEqual(response.request['PATH_INFO'], '/my_items')
         self.assertEqual(response.context['page_title'], page_title)
         self.assertEqual(response.context['empty'], empty)
-        self.assertEqual(response.context['items'].count(), 0)
+        self.assertEqual(len(response.context['items']), 0)
         self.assertQuerysetEqual(response.context['items'], list(items), ordered=False)
-        self.assertTemplateUsed(response, 'auctions/items.html')
\ No newline at end of file
+        self.assertTemplateUsed(response, 'auctions/items.html')
+
+
+##### Listing queries #####
+
+class ListingQueriesTestCase(TestCase):
+
+    def setUp(self):
+        self.other = Category.objects.create(category='Other')
+        self.testuser = User.objects.create_user(username='testuser', password='testuser')
+        self.testuser2 = User.objects.create_user(username='testuser2', password='testuser2')
+        self.client = Client()
+        self.client.login(username='testuser2', password='testuser2')
+
+    def tearDown(self):
+        # Delete image files from project folder
+        for item in Item.objects.all():
+            try:
+                os.remove(item.image.path)
+            except:
+                pass
+
+    def create_items(self, amount):
+        """ Creates items owned by testuser2 and watched by testuser2 """
+        for i in range(amount):
+            item = Item.objects.create(name=f'item{i}', starting_price=10, user=self.testuser2, category=self.other)
+            item.watchlist.add(self.testuser)
+            item.watchlist.add(self.testuser2)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_listing_queries_dont_grow_with_items(self):
+        """ Listing views run the same amount of queries no matter how many items they render """
+        urls = [
+            reverse('index'),
+            reverse('populars'),
+            reverse('category_page', args=('Other',)),
+            reverse('watchlist'),
+            reverse('my_items'),
+        ]
+
+        self.create_items(1)
+        few_items = [self.count_queries(url) for url in urls]
+
+        self.create_items(20)
+        many_items = [self.count_queries(url) for url in urls]
+
+        self.assertEqual(few_items, many_items)
+
+    def test_listing_watched_ids(self):
+        """ Listings know which of their items the user watches, in one query for the page """
+        self.create_items(3)
+        unwatched = Item.objects.create(name='unwatched', starting_price=10, user=self.testuser, category=self.other)
+        response = self.client.get(reverse('index'))
+
+        self.assertEqual(response.context['watched'], set(Item.objects.exclude(pk=unwatched.pk).values_list('id', flat=True)))
+        self.assertContains(response, 'On your watchlist', count=3)
+
+        # anonymous visitors don't watch anything
+        with self.assertNumQueries(0):
+            self.assertEqual(Item.watched_ids(AnonymousUser(), response.context['items']), set())
+
+    def test_listing_loads_user_and_category(self):
+        """ The user and category of every listed item are already loaded """
+        self.create_items(3)
+        items = list(Item.objects.listing().filter(active=True))
+
+        with self.assertNumQueries(0):
+            for item in items:
+                item.user.username
+                str(item.category)
+
+
+class ItemQueriesTestCase(TestCase):
+
+    def setUp(self):
+        other = Category.objects.create(category='Other')
+        self.seller = User.objects.create_user(username='seller', password='seller')
+        self.item = Item.objects.create(name='item', starting_price=10, user=self.seller, category=other)
+        self.client = Client()
+        self.client.login(username='seller', password='seller')
+
+    def add_bids_and_comments(self, amount):
+        """ Bids and comments by a new user each """
+        start = Bid.objects.count()
+        for i in range(start, start + amount):
+            user = User.objects.create_user(username=f'buyer{i}', password='buyer')
+            self.item.place_bid(user, 20 + i)
+            Comment.objects.create(comment=f'comment {i}', user=user, item=self.item)
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('item', args=(self.item.id,)))
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response
+
+    def test_item_queries_dont_grow_with_bids_and_comments(self):
+        """ The item page runs the same queries for 1 or 30 bids and comments """
+        self.add_bids_and_comments(1)
+        few, response = self.count_queries()
+
+        self.add_bids_and_comments(29)
+        many, response = self.count_queries()
+
+        self.assertEqual(few, many)
+        self.assertContains(response, 'buyer29')
+        self.assertContains(response, 'comment 29')
+
+    def test_rows_share_the_item(self):
+        """ Bids and comments hold the page item instead of loading their own """
+        self.add_bids_and_comments(3)
+        response = self.client.get(reverse('item', args=(self.item.id,)))
+        item = response.context['item']
+
+        with self.assertNumQueries(0):
+            for row in list(response.context['bids']) + list(response.context['comments']):
+                self.assertIs(row.item, item)
+                row.user.username
+
+
+    def test_watching(self):
+        """ Watching is checked with one query however many users watch the item """
+        buyer = User.objects.create_user(username='buyer', password='buyer')
+        self.client.login(username='buyer', password='buyer')
+        few, response = self.count_queries()
+        self.assertFalse(response.context['watching'])
+
+        self.item.watchlist.add(buyer)
+        for i in range(20):
+            self.item.watchlist.add(User.objects.create_user(username=f'watcher{i}', password='watcher'))
+        many, response = self.count_queries()
+
+        self.assertEqual(few, many)
+        self.assertTrue(response.context['watching'])
+        self.assertContains(response, 'Remove from watchlist')
+
+
+class ItemHistoryTestCase(TestCase):
+
+    def setUp(self):
+        other = Category.objects.create(category='Other')
+        seller = User.objects.create_user(username='seller', password='seller')
+        self.item = Item.objects.create(name='item', starting_price=10, user=seller, category=other)
+        for i in range(HISTORY_SIZE + 15):
+            user = User.objects.create_user(username=f'buyer{i}', password='buyer')
+            self.item.place_bid(user, 20 + i)
+            Comment.objects.create(comment=f'comment {i}', user=user, item=self.item)
+        self.client = Client()
+
+    def test_item_page_bounded(self):
+        """ The item page only renders the highest bids and the newest comments """
+        response = self.client.get(reverse('item', args=(self.item.id,)))
+
+        self.assertEqual([bid.bid for bid in response.context['bids']], [20 + i for i in range(24, 14, -1)])
+        self.assertEqual([comment.comment for comment in response.context['comments']],
+                         [f'comment {i}' for i in range(24, 14, -1)])
+        self.assertContains(response, 'Show older bids')
+        self.assertContains(response, 'Show older comments')
+        self.assertNotContains(response, 'comment 14')
+
+    def test_load_older_bids(self):
+        """ Following the cursors walks the rest of the bid history, highest first """
+        page = self.client.get(reverse('item', args=(self.item.id,))).context['bids']
+        bids = list(page)
+        while page.has_next:
+            response = self.client.get(reverse('item_bids', args=(self.item.id,)), {'cursor': page.next_cursor, 'size': 6})
+            self.assertTemplateUsed(response, 'auctions/_bids.html')
+            page = response.context['bids']
+            bids += list(page)
+
+        self.assertEqual(bids, list(Bid.objects.filter(item=self.item).order_by('-bid', '-id')))
+
+    def test_load_older_comments(self):
+        """ Following the cursors walks the rest of the comments, newest first """
+        page = self.client.get(reverse('item', args=(self.item.id,))).context['comments']
+        response = self.client.get(reverse('item_comments', args=(self.item.id,)), {'cursor': page.next_cursor})
+
+        self.assertTemplateUsed(response, 'auctions/_comments.html')
+        self.assertFalse(response.context['comments'].has_next)
+        self.assertContains(response, 'comment 14')
+        self.assertContains(response, 'comment 0')
+        self.assertNotContains(response, 'comment 15')
+        self.assertNotContains(response, 'Show older comments')
+
+    def test_fragment_queries(self):
+        """ The item and one query for the rows with their users, whatever the page """
+        page = self.client.get(reverse('item', args=(self.item.id,))).context['bids']
+        with self.assertNumQueries(2):
+            self.client.get(reverse('item_bids', args=(self.item.id,)), {'cursor': page.next_cursor})
+
+    def test_fragment_missing_item(self):
+        response = self.client.get(reverse('item_comments', args=(100,)))
+        self.assertEqual(response.status_code, 404)
+
+
+##### Query budgets #####
+
+class WriteQueriesTestCase(TestCase):
+
+    def setUp(self):
+        other = Category.objects.create(category='Other')
+        testuser = User.objects.create_user(username='testuser', password='testuser')
+        User.objects.create_user(username='testuser2', password='testuser2')
+        self.item = Item.objects.create(name='item', starting_price=20, category=other, user=testuser)
+        self.client = Client()
+        self.client.login(username='testuser2', password='testuser2')
+
+    def test_bid_queries(self):
+        """ Item, SAVEPOINT, price claim, bid INSERT, item UPDATE and RELEASE, the session comes from the cache """
+        with self.assertNumQueries(6):
+            self.client.post(reverse('bid', args=(self.item.id,)), {'bid': 30})
+        self.item.refresh_from_db()
+
+        self.assertEqual(self.item.bid_count, 1)
+        self.assertEqual(self.item.popularity, 1)
+
+    def test_watch_queries(self):
+        """ Item, then the DELETE and the INSERT with its popularity UPDATE each in a savepoint """
+        with self.assertNumQueries(8):
+            self.client.post(reverse('watch', args=(self.item.id,)))
+
+        with self.assertNumQueries(5):
+            self.client.post(reverse('watch', args=(self.item.id,)), {'action': 'remove'})
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.popularity, 0)
+
+    def test_comment_queries(self):
+        """ Item, comment INSERT and item UPDATE """
+        with self.assertNumQueries(3):
+            self.client.post(reverse('comment', args=(self.item.id,)), {'comment': 'Nice item'})
+        self.item.refresh_from_db()
+
+        self.assertEqual(self.item.popularity, 1)
@@ -0,0 +1,35 @@
+from datetime import datetime
+import time
+
+
+# (upper bound, length) in seconds of each unit, ages are shown in the first unit they're below
+UNITS = (
+    ('minute', 3600, 60),
+    ('hour', 86400, 3600),
+    ('day', 2628000, 86400),
+    ('month', 31536000, 2628000),
+    ('year', None, 31536000),
+)
+
+
+def format_elapsed(seconds):
+    """ Formats an age in seconds as '5 minutes ago', '1 hour ago'... Ages under a minute are
+    '0 minutes ago', and negative ones (clock drift) are taken as 0 """
+    seconds = max(0, round(seconds))
+    for unit, limit, length in UNITS:
+        if limit is None or seconds < limit:
+            break
+
+    count = seconds // length
+    return f"{count} {unit}{'' if count == 1 else 's'} ago"
+
+
+def timestamp(moment):
+    """ Unix timestamp of a datetime, timestamps are returned as they are """
+    return moment.timestamp() if isinstance(moment, datetime) else moment
+
+
+def elapsed_since(moments, now=None):
+    """ Formats the age of a list of datetimes or timestamps, all against the same now """
+    now = time.time() if now is None else now
+    return [format_elapsed(now - timestamp(moment)) for moment in moments]
@@ -0,0 +1,69 @@
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile, StopUpload
+from .utils import MAX_IMAGE_SIZE, image_format
+import hashlib
+import os
+
+
+# Message shown when an upload is stopped for going over MAX_IMAGE_SIZE
+TOO_LARGE = 'The image must not surpass 2MB!'
+
+EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png'}
+
+
+class ImageUploadHandler(FileUploadHandler):
+    """ Streams the item image to a temporary file while hashing it, and stops reading the request
+    as soon as it goes over MAX_IMAGE_SIZE so large bodies are never read in full.
+    The completed file is named after its sha256, which the content-addressed storage stores it under.
+    Stopped uploads leave the reason on request.upload_error """
+
+    field_name = 'image'
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        request.upload_error = None
+
+    def stop(self, message):
+        self.request.upload_error = message
+        # the parser closes the partial file, and the rest of the body is never read
+        raise StopUpload(connection_reset=True)
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        if field_name != self.field_name:
+            raise SkipFile()
+        # some clients announce the size of each part
+        if content_length is not None and content_length >= MAX_IMAGE_SIZE:
+            self.stop(TOO_LARGE)
+
+        self.file = TemporaryUploadedFile(file_name, content_type, 0, charset, content_type_extra)
+        self.sha256 = hashlib.sha256()
+        self.extension = os.path.splitext(file_name)[1].lower()
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) >= MAX_IMAGE_SIZE:
+            self.stop(TOO_LARGE)
+        # name the file after its actual format
+        if start == 0:
+            self.extension = EXTENSIONS.get(image_format(raw_data), self.extension)
+        self.sha256.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        self.file.seek(0)
+        self.file.size = file_size
+        # the storage names files after this hash, it's not computed again
+        self.file.sha256 = self.sha256.hexdigest()
+        self.file.name = self.file.sha256 + self.extension
+        return self.file
+
+    def upload_interrupted(self):
+        if hasattr(self, 'file'):
+            self.file.close()
+
+
+def upload_error(request):
+    """ Why the image upload of the request was stopped, None if it wasn't """
+    # parsing the form is what runs the upload handler
+    request.POST
+    return request.upload_error
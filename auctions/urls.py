@@ -11,6 +11,8 @@ urlpatterns = [
     path("edit/<int:item_id>", views.edit, name="edit"),
     path("delete/<int:item_id>", views.delete, name="delete"),
     path("item/<int:item_id>", views.item, name="item"),
+    path("item/<int:item_id>/bids", views.item_bids, name="item_bids"),
+    path("item/<int:item_id>/comments", views.item_comments, name="item_comments"),
     path("watch/<int:item_id>", views.watch, name="watch"),
     path("bid/<int:item_id>", views.bid, name="bid"),
     path("comment/<int:item_id>", views.comment, name="comment"),
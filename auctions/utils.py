@@ -1,19 +1,60 @@
+from PIL import Image
+import warnings
+
+
+# uploads must not surpass 2mb
+MAX_IMAGE_SIZE = 2100000
+
+# largest image accepted, 25 megapixels. Checked against the header so images that would take
+# gigabytes of memory once decoded (decompression bombs) are rejected before resizing them
+MAX_IMAGE_PIXELS = 25000000
+
+# first bytes of every file of the accepted formats
+IMAGE_SIGNATURES = {
+    b'\xff\xd8\xff': 'JPEG',
+    b'\x89PNG\r\n\x1a\n': 'PNG',
+}
+
+
+def image_format(header):
+    """ Format of an image given the first bytes of the file, None if it isn't JPEG or PNG """
+    for signature, format in IMAGE_SIGNATURES.items():
+        if header.startswith(signature):
+            return format
+    return None
+
+
 def image_is_valid(image):
-    """ Checks validity of image """
+    """ Checks validity of image by its content: a JPEG or PNG no larger than MAX_IMAGE_SIZE
+    nor MAX_IMAGE_PIXELS. Only the file header is read, the pixels are never decoded """
     try:
-        imgname = image.name
+        image.name
     # images with an empty string are valid
     except AttributeError:
         return True
 
     # we are dealing with a proper file
-    size = image.size
-    endchars = imgname[-5:]
-    # size must not surpass 2mb
-    if ('.jpg' in endchars or '.jpeg' in endchars or '.png' in endchars) and size < 2100000:
-        return True
-    else:
+    if image.size >= MAX_IMAGE_SIZE:
+        return False
+
+    try:
+        image.seek(0)
+        format = image_format(image.read(8))
+        if format is None:
+            return False
+
+        # Image.open only parses the header, pixels are loaded on demand
+        image.seek(0)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', Image.DecompressionBombWarning)
+            with Image.open(image, formats=[format]) as opened:
+                width, height = opened.size
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombWarning, Image.DecompressionBombError):
         return False
+    finally:
+        image.seek(0)
+
+    return 0 < width * height <= MAX_IMAGE_PIXELS
 
 
 def name_is_valid(name):
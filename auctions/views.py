@@ -1,21 +1,34 @@
+from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, get_object_or_404
 from django.db import IntegrityError
 from django.http import HttpResponse, HttpResponseRedirect
 from django.urls import reverse
-from django.db.models import Max
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.static import serve
 from .utils import image_is_valid, name_is_valid, price_is_valid
-from .models import User, Category, Item, Bid, Comment
+from .uploads import ImageUploadHandler, upload_error
+from .storage import is_content_name
+from .pagination import HISTORY_SIZE, paginate, paginate_request
+from .cache import CATEGORIES, LISTINGS, cache_anonymous, category_namespace
+from .routers import use_replica
+from .models import User, Category, Item, Comment
 
 
+@cache_anonymous(LISTINGS)
+@use_replica
 def index(request):
     """Main page, it displays all recent-active items available"""
-    items = Item.objects.filter(active=True).order_by('updated_at').reverse()
+    # Show from the most recent to the oldest
+    items = Item.objects.listing().filter(active=True)
+    page = paginate_request(request, items, ('updated_at', 'id'))
     page_title = "Recent Items"
     empty = "There are no active items in the auction!"
     return render(request, "auctions/items.html", {
-        'items': items,  #Show from the most recent to the oldest
+        'items': page.object_list,
+        'watched': Item.watched_ids(request.user, page.object_list),
+        'page': page,
         'page_title': page_title,
         'empty': empty
     })
@@ -95,14 +108,30 @@ def register(request):
         return render(request, "auctions/register.html")
 
 
+@csrf_exempt
 def create(request):
     """Create a new item page"""
+    # The image upload handler must be in place before the CSRF check reads the form
+    request.upload_handlers = [ImageUploadHandler(request)]
+    return create_item(request)
+
+
+@csrf_protect
+def create_item(request):
     if request.user.is_authenticated:
         #Make available for all render methods all categories as context
         categories = Category.objects.all()
 
         #In case the user submitted the form:
         if request.method == 'POST':
+            # The upload was stopped, the fields after the image never arrived
+            error = upload_error(request)
+            if error:
+                return render(request, "auctions/create.html", {
+                    'message': error,
+                    'categories': categories
+                })
+
             name = request.POST['name']
             if not name_is_valid(name):
                 return render(request, "auctions/create.html", {
@@ -110,8 +139,8 @@ def create(request):
                     'categories': categories
                 })
 
-            # Get the user object from the current logged in user
-            user = User.objects.get(pk=request.user.id)
+            # The current logged in user, already loaded by the auth middleware
+            user = request.user
             #These fields below are optional and might have None as their value
             description = request.POST['description']
 
@@ -155,41 +184,46 @@ def create(request):
         return HttpResponseRedirect(reverse('login'))
 
 
+# Ordering of the bid history (highest first) and comment threads (newest first)
+BID_KEYS = ('bid', 'id')
+COMMENT_KEYS = ('id',)
+
+
+@use_replica
 def item(request, item_id):
     """ Individual page for each item """
     # Get the particular item we are rendering, along with its bids and comments
-    item = get_object_or_404(Item, pk=item_id)
+    item = get_object_or_404(Item.objects.select_related('user', 'category', 'top_bid__user'), pk=item_id)
 
     # If we are going to open or close the item
     if request.method == "POST":
         if request.user.is_authenticated:
             # only item creator can activate/deactivate item
-            if request.user.id == item.user.id:
+            if request.user.id == item.user_id:
                 # Switch its value between True and False
                 item.active = not item.active
-                item.save()
+                item.save(update_fields=['active', 'updated_at'])
                 return HttpResponseRedirect(reverse('item', args=(item.id,)))
         else:
             return HttpResponseRedirect(reverse('login'))
 
-    # Get the bids in descending order by bid value
-    # Django by default arranges it in ascending order, so we reverse it
-    bids = Bid.objects.filter(item=item).order_by('bid').reverse()
-    comments = Comment.objects.filter(item=item).order_by('id').reverse()
+    # Only the highest bids and the newest comments, the rest are loaded from item_bids and item_comments.
+    # Each comes with its user, and the related managers hand this same item to every row
+    bids = paginate(item.bids.select_related('user'), BID_KEYS, page_size=HISTORY_SIZE)
+    comments = paginate(item.comments.select_related('user'), COMMENT_KEYS, page_size=HISTORY_SIZE)
     
-    # Get the max bid object of the item, 
-    # which is the first one of the list as it was previously ordered by bid value
-    if bids:
-        max_bid = bids.first()  
-        next_bid = max_bid.bid + 1      # Useful for defining html numeric input attributes
-        
-    # If no bids exist, then the next bid is the starting price of the item
-    else:
-        next_bid = float(item.starting_price) + 1
-        max_bid = None
+    # The max bid object is kept on the item, it's None if there are no bids
+    max_bid = item.top_bid
+
+    # Useful for defining html numeric input attributes
+    next_bid = item.price + 1
+
+    # Whether the user watches the item, without loading its watchers
+    watching = item.is_watched_by(request.user)
 
     return render(request, 'auctions/item.html', {
             'item': item,
+            'watching': watching,
             'bids': bids,
             'comments': comments,
             'max_bid': max_bid,
@@ -197,27 +231,50 @@ def item(request, item_id):
         })
 
 
+@use_replica
+def item_bids(request, item_id):
+    """ Page of the bid history of an item coming after the cursor, as table rows for the item page """
+    item = get_object_or_404(Item.objects.only('id'), pk=item_id)
+    bids = paginate_request(request, item.bids.select_related('user'), BID_KEYS)
+    return render(request, 'auctions/_bids.html', {
+        'item': item,
+        'bids': bids
+    })
+
+
+@use_replica
+def item_comments(request, item_id):
+    """ Page of the comments of an item coming after the cursor, as cards for the item page """
+    item = get_object_or_404(Item.objects.only('id'), pk=item_id)
+    comments = paginate_request(request, item.comments.select_related('user'), COMMENT_KEYS)
+    return render(request, 'auctions/_comments.html', {
+        'item': item,
+        'comments': comments
+    })
+
+
 def watch(request, item_id):
-    """ Handles the watchlist addition and deletion from users in a item """
-    item = get_object_or_404(Item, pk=item_id)
+    """ Handles the watchlist addition and deletion from users in a item.
+    Posting action=add or action=remove sets the watchlist explicitly, so retried requests
+    change nothing, without an action the item is toggled """
+    item = get_object_or_404(Item.objects.select_related('category').only('id', 'user_id', 'popularity', 'category__category'), pk=item_id)
     if request.method == "POST":
 
         # Redirect nonauthenticated users to login
         if not request.user.is_authenticated:
             return HttpResponseRedirect(reverse('login'))
 
-        user = User.objects.get(pk=request.user.id)
-
         # Redirect the creator to its item view
-        if user.id == item.user.id:
+        if request.user.id == item.user_id:
             return HttpResponseRedirect(reverse('item', args=(item.id,)))
 
-        #Remove the user from this item watchlist if he/she is already in
-        if user in item.watchlist.all():
-            item.watchlist.remove(user)
-        #Otherwise, add the user to the watchlist of this item
+        action = request.POST.get('action')
+        if action == 'add':
+            item.add_watcher(request.user)
+        elif action == 'remove':
+            item.remove_watcher(request.user)
         else:
-            item.watchlist.add(user)
+            item.toggle_watcher(request.user)
 
     # Redirect the user back to the item page both on GET and POST
     return HttpResponseRedirect(reverse('item', args=(item.id,))) 
@@ -225,17 +282,17 @@ def watch(request, item_id):
 
 def bid(request, item_id):
     """ Handles the bid POST logic for each item """
-    item = get_object_or_404(Item, pk=item_id)
+    item = get_object_or_404(Item.objects.select_related('category'), pk=item_id)
 
     if request.method == "POST":
 
         if not request.user.is_authenticated:
             return HttpResponseRedirect(reverse('login'))
 
-        user = User.objects.get(pk=request.user.id)
+        user = request.user
 
         # Item creator cant bid and is redirected to the item
-        if user.id == item.user.id:
+        if user.id == item.user_id:
             return HttpResponseRedirect(reverse('item', args=(item.id,)))
 
         # bids in not acceptable format are rejected
@@ -243,16 +300,8 @@ def bid(request, item_id):
             return HttpResponseRedirect(reverse('item', args=(item.id,)))
         bid = round(float(request.POST['bid']), 2)
 
-        # Get the maximum bid (or starting price if there is none)
-        try:
-            max_bid = float(Bid.objects.filter(item=item).aggregate(Max('bid'))['bid__max'])
-        except TypeError:
-            max_bid = item.starting_price
-
-        # Valid bids are accepted
-        if bid > max_bid:
-            Bid.objects.create(bid=bid, item=item, user=user)
-        else:
+        # Valid bids (higher than the max bid or starting price) are accepted
+        if item.place_bid(user, bid) is None:
             return HttpResponseRedirect(reverse('item', args=(item.id,)))
 
     # GET requests or finish processing POST
@@ -261,13 +310,13 @@ def bid(request, item_id):
 
 def comment(request, item_id):
     """ Handles the comment POST logic for a item """
-    item = get_object_or_404(Item, pk=item_id)
+    item = get_object_or_404(Item.objects.select_related('category'), pk=item_id)
 
     if request.method == "POST":
         if not request.user.is_authenticated:
             return HttpResponseRedirect(reverse('login'))
 
-        user = User.objects.get(pk=request.user.id)
+        user = request.user
 
         # Create comment if the user didn't submit an empty comment
         if len(request.POST['comment']) > 1:
@@ -282,11 +331,14 @@ def watchlist(request):
     if request.user.is_authenticated:
         page_title = "Watchlist"
         empty = "There are no active items in your watchlist!"
-        user = User.objects.get(pk=request.user.id)
+        user = request.user
         # Get all the items on the user watchlist
-        items = user.watchlist.all().order_by('updated_at').reverse()
+        items = Item.objects.listing().filter(watchlist=user)
+        page = paginate_request(request, items, ('updated_at', 'id'))
         return render(request, "auctions/items.html", {
-            'items': items,
+            'items': page.object_list,
+            'watched': {item.id for item in page.object_list},
+            'page': page,
             'page_title': page_title,
             'empty': empty
         })
@@ -296,6 +348,8 @@ def watchlist(request):
         return HttpResponseRedirect(reverse('login'))
 
 
+@cache_anonymous(CATEGORIES)
+@use_replica
 def category(request):
     """ Displays a link list of all categories to the user """
     categories = Category.objects.all()
@@ -304,22 +358,35 @@ def category(request):
     })
 
 
+@cache_anonymous(category_namespace('{category_name}'))
+@use_replica
 def category_page(request, category_name):
     """ Displays all active items for a given category """
     # Get the category object from the name given in the URL
     category = get_object_or_404(Category, category=category_name)
     empty = "There are no active items for this category!"
     # Get all active items from the given category from the most recent
-    items = Item.objects.filter(category=category, active=True).order_by('updated_at').reverse()
+    items = Item.objects.listing().filter(category=category, active=True)
+    page = paginate_request(request, items, ('updated_at', 'id'))
     return render(request, "auctions/items.html", {
-        'items': items,
+        'items': page.object_list,
+        'watched': Item.watched_ids(request.user, page.object_list),
+        'page': page,
         'page_title': category_name,
         'empty': empty
     })
 
 
+@csrf_exempt
 def edit(request, item_id):
     """ Display the create template with the item data in the form """
+    # The image upload handler must be in place before the CSRF check reads the form
+    request.upload_handlers = [ImageUploadHandler(request)]
+    return edit_item(request, item_id)
+
+
+@csrf_protect
+def edit_item(request, item_id):
     #Make available for all render methods all categories as context
     item = get_object_or_404(Item, pk=item_id)
     
@@ -327,10 +394,18 @@ def edit(request, item_id):
         categories = Category.objects.all()
 
         # item creator (authorized user)
-        if request.user.id == item.user.id:
+        if request.user.id == item.user_id:
 
             #In case the user submitted the form:
             if request.method == 'POST':
+                # The upload was stopped, the fields after the image never arrived
+                error = upload_error(request)
+                if error:
+                    return render(request, 'auctions/edit.html', {
+                        'message': error,
+                        'categories': categories,
+                        'item': item
+                    })
 
                 name = request.POST['name']
                 if name_is_valid(name):
@@ -345,10 +420,11 @@ def edit(request, item_id):
                 #These fields below are optional and might have None as their value
                 item.description = request.POST['description']
 
+                # Keep the old image if no new image was uploaded
                 try:
                     image = request.FILES['image']
                 except KeyError:
-                    item.image = ''
+                    pass
                 else:
                     if image_is_valid(image):
                         item.image = image
@@ -398,7 +474,7 @@ def delete(request, item_id):
 
         if request.user.is_authenticated:
 
-            if request.user.id == item.user.id:
+            if request.user.id == item.user_id:
                 item.delete()
                 return HttpResponseRedirect(reverse('index'))
 
@@ -415,14 +491,19 @@ def delete(request, item_id):
         return HttpResponseRedirect(reverse('item', args=(item.id,)))
 
 
+@cache_anonymous(LISTINGS)
+@use_replica
 def populars(request):
     """ Displays active items ordered by popularity in descending order """
-    items = Item.objects.filter(active=True).order_by('popularity').reverse()
+    items = Item.objects.listing().filter(active=True)
+    page = paginate_request(request, items, ('popularity', 'id'))
     page_title = 'Most popular'
     empty = 'There are no active items in the auction!'
 
     return render(request, 'auctions/items.html', {
-        'items': items,
+        'items': page.object_list,
+        'watched': Item.watched_ids(request.user, page.object_list),
+        'page': page,
         'page_title': page_title,
         'empty': empty
     })
@@ -431,17 +512,26 @@ def populars(request):
 def my_items(request):
     """ Display all user's items """
     if request.user.is_authenticated:
-        user = User.objects.get(id=request.user.id)
-        items = Item.objects.filter(active=True, user=user).order_by('created_at').reverse()
+        items = Item.objects.listing().filter(active=True, user=request.user)
+        page = paginate_request(request, items, ('created_at', 'id'))
         page_title = 'My items'
         empty = 'You have no items!'
 
         return render(request, 'auctions/items.html', {
-            'items': items,
+            'items': page.object_list,
+            'page': page,
             'page_title': page_title,
             'empty': empty
         })
 
     # user is not authenticated
     else:
-        return HttpResponseRedirect(reverse('login'))
\ No newline at end of file
+        return HttpResponseRedirect(reverse('login'))
+
+
+def media(request, path):
+    """ Serves uploaded images. Files named after their content never change, so browsers can keep them for good """
+    response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    if is_content_name(path):
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
@@ -0,0 +1,74 @@
+""" Render time of a listing of 1,000 item cards with a cold and a warm fragment cache.
+
+Run from the project root: python benchmarks/card_cache.py [--items 1000] [--runs 5]
+It works on an in-memory database, the project database is never touched """
+from datetime import timedelta
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'commerce.settings')
+
+import django
+from django.conf import settings
+
+settings.DATABASES['default']['NAME'] = ':memory:'
+django.setup()
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+from django.utils import timezone
+from auctions.models import Category, Item, User
+
+
+def create_items(count):
+    """ Items spread over the last year, so their cards show every kind of relative time """
+    user = User.objects.create_user(username='bench', password='bench')
+    category = Category.objects.create(category='Other')
+    Item.objects.bulk_create([
+        Item(name=f'Item {number}', description='A benchmark item', starting_price=10 + number,
+             user=user, category=category)
+        for number in range(count)
+    ], batch_size=500)
+    # created_at is set on insert, spread it afterwards
+    now = timezone.now()
+    for pk in Item.objects.values_list('pk', flat=True):
+        Item.objects.filter(pk=pk).update(created_at=now - timedelta(hours=pk * 9))
+
+
+def render(items, request):
+    start = time.perf_counter()
+    render_to_string('auctions/items.html', {'items': items, 'page_title': 'Benchmark', 'empty': ''}, request)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--runs', type=int, default=5)
+    options = parser.parse_args()
+
+    call_command('migrate', verbosity=0)
+    create_items(options.items)
+    request = RequestFactory().get('/')
+    request.user = User.objects.get(username='bench')
+
+    cold, warm = [], []
+    for _ in range(options.runs):
+        items = list(Item.objects.listing())
+        cache.clear()
+        cold.append(render(items, request))
+        warm.append(render(items, request))
+
+    print(f"{options.items} cards, best of {options.runs} runs")
+    print(f"cold cache: {min(cold) * 1000:8.1f} ms")
+    print(f"warm cache: {min(warm) * 1000:8.1f} ms")
+    print(f"speedup:    {min(cold) / min(warm):8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
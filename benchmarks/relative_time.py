@@ -0,0 +1,106 @@
+""" Micro-benchmarks of the relative times shown on cards, bid rows and comments.
+
+Compares the per-row Item.elapsed_time method as it was (a clock read per call, and bid and
+comment rows loading their item) with auctions.timesince, which formats a whole list against one now.
+Run from the project root: python benchmarks/relative_time.py [--rows 1000] [--runs 5]
+It works on an in-memory database, the project database is never touched """
+from datetime import datetime, timedelta
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'commerce.settings')
+
+import django
+from django.conf import settings
+
+settings.DATABASES['default']['NAME'] = ':memory:'
+django.setup()
+
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from auctions.models import Bid, Category, Item, User
+from auctions.timesince import elapsed_since
+
+
+def legacy_elapsed_time(time_value):
+    """ Item.elapsed_time before auctions.timesince, given a timestamp """
+    time = ''
+    time_created = round(datetime.now().timestamp() - time_value)
+
+    if 0 <= time_created < 3600:
+        time_created = time_created // 60
+        time += str(time_created) + ' minute'
+    elif 3600 < time_created < 86400:
+        time_created = time_created // 3600
+        time += str(time_created) + ' hour'
+    elif 86400 < time_created < 2628000:
+        time_created = time_created // 86400
+        time += str(time_created) + ' day'
+    elif 2628000 < time_created < 31536000:
+        time_created = time_created // 2628000
+        time += str(time_created) + ' month'
+    elif time_created > 31536000:
+        time_created = time_created // 31536000
+        time += str(time_created) + ' year'
+
+    if time_created != 1:
+        time += 's'
+    time += ' ago'
+    return time
+
+
+def legacy_bid_time(bid):
+    """ Bid.bid_time before auctions.timesince, it went through the item of the bid """
+    bid.item
+    return legacy_elapsed_time(bid.bid_date.timestamp())
+
+
+def create_bids(count):
+    seller = User.objects.create_user(username='seller', password='bench')
+    buyer = User.objects.create_user(username='buyer', password='bench')
+    category = Category.objects.create(category='Other')
+    Item.objects.bulk_create([
+        Item(name=f'Item {number}', starting_price=10, user=seller, category=category) for number in range(count // 10)
+    ])
+    items = list(Item.objects.all())
+    Bid.objects.bulk_create([
+        Bid(bid=20 + number, item=items[number % len(items)], user=buyer) for number in range(count)
+    ])
+
+
+def best(function, runs):
+    return min(timeit.repeat(function, number=1, repeat=runs)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--runs', type=int, default=5)
+    options = parser.parse_args()
+
+    now = timezone.now()
+    timestamps = [(now - timedelta(seconds=random.randint(0, 40000000))).timestamp() for _ in range(options.rows)]
+    print(f"Formatting {options.rows} timestamps, best of {options.runs} runs")
+    print(f"  per row, clock read each call: {best(lambda: [legacy_elapsed_time(t) for t in timestamps], options.runs):8.2f} ms")
+    print(f"  batched against one now:       {best(lambda: elapsed_since(timestamps), options.runs):8.2f} ms")
+
+    call_command('migrate', verbosity=0)
+    create_bids(options.rows)
+    print(f"\nFormatting {options.rows} bid rows loaded without their items")
+    for name, function in (
+        ('bid.bid_time through the item', lambda bids: [legacy_bid_time(bid) for bid in bids]),
+        ('elapsed_since on bid dates', lambda bids: elapsed_since([bid.bid_date for bid in bids])),
+    ):
+        with CaptureQueriesContext(connection) as queries:
+            duration = best(lambda: function(list(Bid.objects.all())), options.runs)
+        print(f"  {name:31} {duration:8.2f} ms, {len(queries) // options.runs} queries")
+
+
+if __name__ == '__main__':
+    main()
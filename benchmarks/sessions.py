@@ -0,0 +1,95 @@
+""" Requests per second of logged in page views with each session and authentication setup.
+
+Compares database sessions with django's AuthenticationMiddleware (the previous setup), database
+sessions with the session snapshot of the user, and cached_db sessions with the snapshot (the current setup).
+Run from the project root: python benchmarks/sessions.py [--requests 500] [--runs 3]
+It works on a temporary database file, the project database is never touched """
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'commerce.settings')
+
+import django
+from django.conf import settings
+
+database = tempfile.NamedTemporaryFile(suffix='.sqlite3', delete=False)
+settings.DATABASES['default']['NAME'] = database.name
+django.setup()
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from auctions.models import Category, Item, User
+
+
+def middleware(authentication):
+    return [
+        authentication if name == 'auctions.middleware.CachedAuthenticationMiddleware' else name
+        for name in settings.MIDDLEWARE
+    ]
+
+
+SETUPS = (
+    ('db sessions, user query', 'django.contrib.sessions.backends.db',
+        middleware('django.contrib.auth.middleware.AuthenticationMiddleware')),
+    ('db sessions, user snapshot', 'django.contrib.sessions.backends.db', settings.MIDDLEWARE),
+    ('cached_db sessions, user snapshot', 'django.contrib.sessions.backends.cached_db', settings.MIDDLEWARE),
+)
+
+
+def create_data():
+    seller = User.objects.create_user(username='seller', password='bench')
+    User.objects.create_user(username='buyer', password='bench')
+    category = Category.objects.create(category='Other')
+    item = Item.objects.create(name='Item', starting_price=10, user=seller, category=category)
+    return item
+
+
+def requests_per_second(client, urls, requests, runs):
+    """ Best rate of runs rounds of requests spread over the urls """
+    best = 0
+    for _ in range(runs):
+        start = time.perf_counter()
+        for number in range(requests):
+            client.get(urls[number % len(urls)])
+        best = max(best, requests / (time.perf_counter() - start))
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--runs', type=int, default=3)
+    options = parser.parse_args()
+
+    call_command('migrate', verbosity=0)
+    item = create_data()
+    urls = [reverse('watchlist'), reverse('my_items'), reverse('item', args=(item.id,))]
+
+    print(f"{options.requests} logged in requests over {len(urls)} pages, best of {options.runs} runs")
+    for name, engine, stack in SETUPS:
+        with override_settings(SESSION_ENGINE=engine, MIDDLEWARE=stack, ALLOWED_HOSTS=['testserver']):
+            client = Client()
+            client.login(username='buyer', password='bench')
+            # the first request may take the user snapshot
+            assert client.get(urls[0]).status_code == 200
+
+            with CaptureQueriesContext(connection) as queries:
+                client.get(urls[0])
+            # counted before the timed requests, which reset the queries log
+            query_count = len(queries)
+            rate = requests_per_second(client, urls, options.requests, options.runs)
+        print(f"  {name:34} {rate:8.1f} req/s, {query_count} queries on the watchlist")
+
+    connection.close()
+    os.remove(database.name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+""" Concurrent reads and writes on SQLite with and without the SQLITE_PRAGMAS tuning.
+
+Threads, each with its own connection, load item pages and post bids and comments for a few
+seconds. For every configuration it prints the requests done per second and how many failed
+with "database is locked". Every configuration gets a fresh database file, as WAL mode is kept in the file.
+Run from the project root: python benchmarks/sqlite_concurrency.py [--threads 8] [--seconds 5] [--writes 0.3]
+The project database is never touched """
+import argparse
+import itertools
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'commerce.settings')
+
+import django
+from django.conf import settings
+
+directory = tempfile.mkdtemp()
+settings.DATABASES['default']['NAME'] = os.path.join(directory, 'empty.sqlite3')
+# every thread logs in with its own user, keep the password hashing out of the measure
+settings.PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+settings.ALLOWED_HOSTS = ['testserver']
+settings.IMAGE_JOB_WORKERS = 0
+django.setup()
+# failed requests are counted, not logged
+logging.getLogger('django.request').setLevel(logging.CRITICAL)
+
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections
+from django.test import Client, override_settings
+from django.urls import reverse
+from auctions.models import Category, Item, User
+
+
+CONFIGURATIONS = (
+    ('rollback journal, no busy timeout', {'busy_timeout': 0}),
+    # python's sqlite3 waits up to 5 seconds by default
+    ('rollback journal, 5s timeout', {}),
+    ('SQLITE_PRAGMAS (WAL)', settings.SQLITE_PRAGMAS),
+)
+
+
+def create_database(name, threads):
+    """ A fresh database with an item and a user per thread """
+    connections.close_all()
+    settings.DATABASES['default']['NAME'] = os.path.join(directory, name)
+    call_command('migrate', verbosity=0)
+    seller = User.objects.create_user(username='seller', password='bench')
+    item = Item.objects.create(name='Item', starting_price=10, user=seller, category=Category.objects.create(category='Other'))
+    for number in range(threads):
+        User.objects.create_user(username=f'buyer{number}', password='bench')
+    connections.close_all()
+    return item
+
+
+def worker(number, client, item, deadline, writes, amounts, results):
+    done = locked = 0
+    while time.monotonic() < deadline:
+        try:
+            draw = random.random()
+            if draw < writes / 2:
+                client.post(reverse('bid', args=(item.id,)), {'bid': next(amounts)})
+            elif draw < writes:
+                client.post(reverse('comment', args=(item.id,)), {'comment': f'comment by buyer{number}'})
+            else:
+                client.get(reverse('item', args=(item.id,)))
+            done += 1
+        except OperationalError as error:
+            if 'locked' not in str(error):
+                raise
+            locked += 1
+    connection.close()
+    results.append((done, locked))
+
+
+def run(item, threads, seconds, writes):
+    """ Requests done and failed with a lock error by all the threads """
+    # logged in before the clock starts, logging in writes too
+    clients = []
+    for number in range(threads):
+        client = Client()
+        client.login(username=f'buyer{number}', password='bench')
+        clients.append(client)
+    connections.close_all()
+
+    amounts = itertools.count(11)
+    results = []
+    deadline = time.monotonic() + seconds
+    workers = [
+        threading.Thread(target=worker, args=(number, clients[number], item, deadline, writes, amounts, results))
+        for number in range(threads)
+    ]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return sum(done for done, locked in results), sum(locked for done, locked in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--writes', type=float, default=0.3, help="Share of the requests that post a bid or a comment")
+    options = parser.parse_args()
+
+    print(f"{options.threads} threads for {options.seconds}s, {options.writes:.0%} writes")
+    try:
+        for number, (name, pragmas) in enumerate(CONFIGURATIONS):
+            with override_settings(SQLITE_PRAGMAS=pragmas):
+                item = create_database(f'bench{number}.sqlite3', options.threads)
+                done, locked = run(item, options.threads, options.seconds, options.writes)
+            total = done + locked
+            print(f"  {name:34} {done / options.seconds:8.1f} req/s, "
+                  f"{locked} of {total} locked ({locked / max(total, 1):.1%})")
+    finally:
+        connections.close_all()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -45,7 +45,8 @@ MIDDLEWARE = [
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'auctions.middleware.CachedAuthenticationMiddleware',
+    'auctions.middleware.PrimaryPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -81,6 +82,70 @@ DATABASES = {
     }
 }
 
+# Read-only copy of the database that listing and detail pages may read from, kept up to date
+# by an external replication tool. Used only when COMMERCE_REPLICA_DB is set, see auctions/routers.py
+DATABASES['replica'] = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': os.environ.get('COMMERCE_REPLICA_DB', DATABASES['default']['NAME']),
+}
+
+DATABASE_ROUTERS = ['auctions.routers.ReplicaRouter']
+
+REPLICA_DATABASE = 'replica' if os.environ.get('COMMERCE_REPLICA_DB') else None
+
+# Seconds a client reads from the primary after writing, longer than the replication lag
+REPLICA_PIN_SECONDS = 10
+
+# Applied to every new SQLite connection, see auctions/signals.py. WAL lets readers and the
+# writer work at the same time, and writers wait for the lock instead of failing right away
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    # WAL stays consistent with NORMAL, only the last commits may be lost on a power failure
+    'synchronous': 'NORMAL',
+    # milliseconds
+    'busy_timeout': 20000,
+    # bytes of the database file read through memory mapping
+    'mmap_size': 256 * 1024 * 1024,
+    # negative values are in KiB, 20MB of page cache per connection
+    'cache_size': -20000,
+}
+
+# Cache of the pages rendered for anonymous visitors, see auctions/cache.py.
+# Local memory works for a single process, set COMMERCE_CACHE_DIR to share
+# a file based cache between several processes
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'commerce',
+        # item card fragments take an entry each
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    # kept apart so pages and fragments never evict sessions
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'sessions',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
+if os.environ.get('COMMERCE_CACHE_DIR'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ['COMMERCE_CACHE_DIR'],
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+    CACHES['sessions'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(os.environ['COMMERCE_CACHE_DIR'], 'sessions'),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+
+# Sessions are read from the cache and written through to the database, which keeps them
+# across restarts and cache evictions. Anonymous visitors never get a session.
+# Expired sessions are removed by the expire_sessions management command
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'sessions'
+
 AUTH_USER_MODEL = 'auctions.User'
 
 # Password validation
@@ -129,4 +194,11 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'auctions/static/auctions/images')
 
 MEDIA_URL = '/media/'
 
+# Uploaded files are stored under the hash of their content, see auctions/storage.py
+DEFAULT_FILE_STORAGE = 'auctions.storage.ContentAddressedStorage'
+
+# Threads resizing uploaded images in the web process, 0 leaves the
+# work to the process_image_jobs management command
+IMAGE_JOB_WORKERS = 2
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -17,11 +17,10 @@ from django.contrib import admin
 from django.urls import include, path
 
 from django.conf import settings
-from django.conf.urls.static import static
+from auctions.views import media
 
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path(f"{settings.MEDIA_URL.strip('/')}/<path:path>", media, name="media"),
     path("", include("auctions.urls"))
-]
-
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+]
\ No newline at end of file